@@ -0,0 +1,225 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+
+import papyon
+import papyon.event
+
+__all__ = ['ButterflyAddressBookIndex']
+
+logger = logging.getLogger('Butterfly.AddressBookIndex')
+
+
+class ButterflyAddressBookIndex(object):
+    """Lookup tables over the papyon address book.
+
+    The tables are built from the address book the first time they are
+    needed and are then kept up to date from the address book events, so
+    that resolving a contact never has to walk the address book again.
+
+    The event dispatcher forwards the events to the index before anything
+    else handles them, so the index is always current when it is used."""
+
+    def __init__(self, client):
+        self._client = client
+        self.reset()
+
+    def reset(self):
+        self._contacts = None
+        self._unknown_contacts = set()
+        self._groups = None
+        self._group_keys = None
+        self._group_names = None
+        self._contact_groups = None
+        self._group_contacts = None
+
+    def search_contact(self, account, network):
+        """Find the contact with the given lowercase account on the given
+        network, or None if the address book doesn't know about it."""
+        if self._contacts is None:
+            self._build_contacts()
+
+        key = (account, network)
+        contact = self._contacts.get(key, None)
+        if contact is not None or key in self._unknown_contacts:
+            return contact
+
+        # Contacts who talk to us without being in our list get into the
+        # address book without any event, so check once before caching.
+        contact = self._client.address_book.search_contact(account, network)
+        if contact is None:
+            self._unknown_contacts.add(key)
+        else:
+            self._contacts[key] = contact
+        return contact
+
+    def learn_contact(self, contact):
+        """Record a contact we got from papyon without an address book
+        event."""
+        if self._contacts is None:
+            return
+        key = (contact.account.lower(), contact.network_id)
+        self._contacts[key] = contact
+        self._unknown_contacts.discard(key)
+
+    def search_group(self, name):
+        """Find the group with the given unicode name, ignoring case as
+        the server does."""
+        if self._groups is None:
+            self._build_groups()
+        key = name.lower()
+        group = self._groups.get(key, None)
+        if group is not None:
+            return group
+
+        # The group channels get the address book events on their own, so
+        # they may look up a new group before we got its event. papyon adds
+        # it to the address book first, so check there before giving up.
+        for group in self._client.address_book.groups:
+            if group.name.decode("utf-8").lower() == key:
+                self._add_group(group)
+                return group
+        return None
+
+    def get_group_name(self, group):
+        """Get the unicode name of a group."""
+        if self._groups is None:
+            self._build_groups()
+        name = self._group_names.get(group, None)
+        if name is None:
+            name = group.name.decode("utf-8")
+        return name
+
+    def get_group_names(self):
+        if self._groups is None:
+            self._build_groups()
+        return self._group_names.values()
+
+    def get_contact_groups(self, contact):
+        """Get the set of groups a contact belongs to."""
+        if self._contact_groups is None:
+            self._build_contact_groups()
+        return self._contact_groups.get(contact, frozenset())
+
+    def get_group_contacts(self, group):
+        """Get the set of contacts belonging to a group."""
+        if self._contact_groups is None:
+            self._build_contact_groups()
+        return self._group_contacts.get(group, frozenset())
+
+    def _build_contacts(self):
+        self._contacts = {}
+        for contact in self._client.address_book.contacts:
+            key = (contact.account.lower(), contact.network_id)
+            self._contacts[key] = contact
+
+    def _build_groups(self):
+        self._groups = {}
+        self._group_keys = {}
+        self._group_names = {}
+        for group in self._client.address_book.groups:
+            self._add_group(group)
+
+    def _build_contact_groups(self):
+        self._contact_groups = {}
+        self._group_contacts = {}
+        for contact in self._client.address_book.contacts:
+            for group in contact.groups:
+                self._add_group_contact(group, contact)
+
+    def _add_group_contact(self, group, contact):
+        self._contact_groups.setdefault(contact, set()).add(group)
+        self._group_contacts.setdefault(group, set()).add(contact)
+
+    def _remove_group_contact(self, group, contact):
+        groups = self._contact_groups.get(contact, None)
+        if groups is not None:
+            groups.discard(group)
+        contacts = self._group_contacts.get(group, None)
+        if contacts is not None:
+            contacts.discard(contact)
+
+    def _add_group(self, group):
+        name = group.name.decode("utf-8")
+        key = name.lower()
+        self._groups[key] = group
+        self._group_keys[group] = key
+        self._group_names[group] = name
+
+    def _remove_group(self, group):
+        key = self._group_keys.pop(group, None)
+        self._group_names.pop(group, None)
+        if key is not None and self._groups.get(key, None) is group:
+            del self._groups[key]
+
+    # papyon.event.ClientEventInterface
+    def on_client_state_changed(self, state):
+        # The address book is (re)filled without individual events
+        if state == papyon.event.ClientState.SYNCHRONIZED:
+            self.reset()
+            # papyon renames a group before telling us, so its old name
+            # has to be recorded before any rename
+            self._build_groups()
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_contact_added(self, contact):
+        self._unknown_contacts = set()
+        if self._contacts is not None:
+            key = (contact.account.lower(), contact.network_id)
+            self._contacts[key] = contact
+        if self._contact_groups is not None:
+            for group in contact.groups:
+                self._add_group_contact(group, contact)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_contact_deleted(self, contact):
+        if self._contacts is not None:
+            key = (contact.account.lower(), contact.network_id)
+            if self._contacts.get(key, None) is contact:
+                del self._contacts[key]
+        if self._contact_groups is not None:
+            for group in self._contact_groups.pop(contact, ()):
+                self._group_contacts.get(group, set()).discard(contact)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_added(self, group):
+        if self._groups is not None:
+            self._add_group(group)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_deleted(self, group):
+        if self._groups is not None:
+            self._remove_group(group)
+        if self._contact_groups is not None:
+            for contact in self._group_contacts.pop(group, ()):
+                self._contact_groups.get(contact, set()).discard(group)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_renamed(self, group):
+        if self._groups is not None:
+            self._remove_group(group)
+            self._add_group(group)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_contact_added(self, group, contact):
+        if self._contact_groups is not None:
+            self._add_group_contact(group, contact)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_contact_deleted(self, group, contact):
+        if self._contact_groups is not None:
+            self._remove_group_contact(group, contact)
@@ -17,6 +17,7 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import logging
+import weakref
 
 import dbus
 import telepathy
@@ -25,21 +26,37 @@ import papyon
 from papyon.service.description.AB.constants import \
     ContactGeneral, ContactAnnotations
 
-from butterfly.util.decorator import async
+from butterfly.util.idle import IdleBatcher
+from butterfly.util.request_queue import RequestQueue
 
 __all__ = ['ButterflyAliasing']
 
 logger = logging.getLogger('Butterfly.Aliasing')
 
+# Maximum number of nickname updates sent to the address book at once
+MAX_ALIAS_UPDATES_IN_FLIGHT = 4
+
 class ButterflyAliasing(
-        telepathy.server.ConnectionInterfaceAliasing,
-        papyon.event.ContactEventInterface,
-        papyon.event.ProfileEventInterface):
+        telepathy.server.ConnectionInterfaceAliasing):
 
     def __init__(self):
         telepathy.server.ConnectionInterfaceAliasing.__init__(self)
-        papyon.event.ContactEventInterface.__init__(self, self.msn_client)
-        papyon.event.ProfileEventInterface.__init__(self, self.msn_client)
+
+        # Alias changes are signalled in batches, and only if the alias
+        # differs from the last one signalled for the handle
+        self._alias_batcher = IdleBatcher(self._emit_aliases_changed)
+        self._signalled_aliases = weakref.WeakKeyDictionary()
+
+        # Decoded aliases by handle, along with the contact they were
+        # computed from, see _get_handle_alias
+        self._alias_cache = weakref.WeakKeyDictionary()
+
+        # Nickname updates sent to the address book, by handle
+        self._alias_updates = RequestQueue(MAX_ALIAS_UPDATES_IN_FLIGHT)
+
+        # Latest nickname queued for each handle, until its request is done:
+        # the contact infos only change once the address book has answered
+        self._requested_nicknames = weakref.WeakKeyDictionary()
 
     def GetAliasFlags(self):
         return telepathy.constants.CONNECTION_ALIAS_FLAG_USER_SET
@@ -69,63 +86,98 @@ class ButterflyAliasing(
                     continue
 
                 new_alias = alias.encode("utf-8")
-                old_alias = contact.infos.get(ContactGeneral.ANNOTATIONS, {}).\
-                    get(ContactAnnotations.NICKNAME, None)
+                old_alias = self._requested_nicknames.get(handle, None)
+                if old_alias is None:
+                    old_alias = contact.infos.get(ContactGeneral.ANNOTATIONS,
+                            {}).get(ContactAnnotations.NICKNAME, None)
                 if new_alias == old_alias:
                     continue
 
-                infos = {ContactGeneral.ANNOTATIONS :
-                            {ContactAnnotations.NICKNAME : new_alias}
-                        }
-                self.msn_client.address_book.update_contact_infos(contact, infos)
+                self._update_nickname(handle, contact, new_alias)
             else:
-                self.msn_client.profile.display_name = alias.encode('utf-8')
+                self._profile_updater.set('display_name',
+                        alias.encode('utf-8'))
                 logger.info("Self alias changed to '%s'" % alias)
-                self.AliasesChanged(((self._self_handle, alias), ))
-
-    # papyon.event.ContactEventInterface
-    def on_contact_display_name_changed(self, contact):
-        self._contact_alias_changed(contact)
+                self._contact_alias_changed(self._self_handle,
+                        self.msn_client.profile)
 
-    # papyon.event.ContactEventInterface
-    def on_contact_infos_changed(self, contact, updated_infos):
+    # Dispatched by ButterflyEventDispatcher
+    def _contact_infos_changed(self, handle, contact, updated_infos):
         alias = updated_infos.get(ContactGeneral.ANNOTATIONS, {}).\
             get(ContactAnnotations.NICKNAME, None)
 
-        if alias is not None or alias != "":
-            self._contact_alias_changed(contact)
+        # An empty nickname is a change too, back to the display name
+        if alias is not None:
+            self._contact_alias_changed(handle, contact)
 
-    # papyon.event.ContactEventInterface
-    def on_contact_memberships_changed(self, contact):
-        handle = self.ensure_contact_handle(contact)
+    # Dispatched by ButterflyEventDispatcher
+    def _flush_pending_alias(self, handle, contact):
         if contact.is_member(papyon.Membership.FORWARD):
             alias = handle.pending_alias
             if alias is not None:
-                infos = {ContactGeneral.ANNOTATIONS : \
-                            {ContactAnnotations.NICKNAME : alias.encode('utf-8')}
-                        }
-                self.msn_client.address_book.\
-                    update_contact_infos(contact, infos)
+                self._update_nickname(handle, contact, alias.encode('utf-8'))
                 handle.pending_alias = None
-
-    # papyon.event.ProfileEventInterface
-    def on_profile_display_name_changed(self):
-        self._contact_alias_changed(self.msn_client.profile)
+                self._alias_cache.pop(handle, None)
+
+    def _update_nickname(self, handle, contact, nickname):
+        """Queue the update of the nickname annotation of a contact.
+
+        Each contact needs its own address book request, so the updates go
+        through a queue bounding the number of requests in flight. A newer
+        nickname replaces one which is still waiting."""
+        def update(done_cb, failed_cb):
+            infos = {ContactGeneral.ANNOTATIONS :
+                        {ContactAnnotations.NICKNAME : nickname}
+                    }
+            self.msn_client.address_book.update_contact_infos(contact, infos,
+                    done_cb=done_cb, failed_cb=failed_cb)
+
+        def request_done():
+            if self._requested_nicknames.get(handle, None) == nickname:
+                del self._requested_nicknames[handle]
+
+        def done_cb(*args):
+            request_done()
+            logger.info("Nickname of %s set to '%s'" %
+                    (unicode(handle), nickname))
+
+        def failed_cb(*args):
+            request_done()
+            logger.warning("Failed to set nickname of %s to '%s': %s" %
+                    (unicode(handle), nickname, args))
+
+        self._requested_nicknames[handle] = nickname
+        self._alias_updates.push(handle, update, done_cb, failed_cb)
 
     def _get_alias(self, handle_id):
         """Get the alias from one handle id"""
         handle = self.handle(telepathy.HANDLE_TYPE_CONTACT, handle_id)
+        return self._get_handle_alias(handle, handle.contact)
+
+    def _get_handle_alias(self, handle, contact):
+        """Get the alias of an already resolved handle"""
+        if handle.pending_alias is not None:
+            return handle.pending_alias
+
+        if handle == self._self_handle:
+            contact = None # the profile is used whatever the caller gave
+        cached = self._alias_cache.get(handle, None)
+        if cached is not None and cached[0] is contact:
+            return cached[1]
+
+        alias = self._compute_alias(handle, contact)
+        self._alias_cache[handle] = (contact, alias)
+        return alias
+
+    def _compute_alias(self, handle, contact):
         if handle == self._self_handle:
-            display_name = self.msn_client.profile.display_name
+            display_name = self._profile_updater.get('display_name')
             if display_name == "":
                 display_name = handle.get_name().split('@', 1)[0]
                 display_name = display_name.replace("_", " ")
             alias = unicode(display_name, 'utf-8')
         else:
-            contact = handle.contact
-            if handle.pending_alias is not None:
-                alias = handle.pending_alias
-            elif contact is None:
+            if contact is None:
                 alias = handle.account
             else:
                 alias = contact.infos.get(ContactGeneral.ANNOTATIONS, {}).\
@@ -135,19 +187,25 @@ class ButterflyAliasing(
                 alias = unicode(alias, 'utf-8')
         return alias
 
-    @async
-    def _contact_alias_changed(self, contact):
-        alias = None
-
-        handle = self.ensure_contact_handle(contact)
-        if handle != self._self_handle:
-            alias = contact.infos.get(ContactGeneral.ANNOTATIONS, {}).\
-                get(ContactAnnotations.NICKNAME, None)
-
-        if alias == "" or alias is None:
-            alias = contact.display_name
-
-        alias = unicode(alias, 'utf-8')
-        logger.info("Contact %s alias changed to '%s'" % (unicode(handle), alias))
-        self.AliasesChanged([(handle, alias)])
-
+    # Dispatched by ButterflyEventDispatcher
+    def _contact_alias_changed(self, handle, contact):
+        # The alias is only computed when the batch is flushed, by then
+        # papyon is done updating the contact
+        self._alias_cache.pop(handle, None)
+        self._alias_batcher.add(handle, contact)
+
+    def _emit_aliases_changed(self, changes):
+        aliases = []
+        for handle, contact in changes:
+            # Drop what may have been cached before papyon was done
+            self._alias_cache.pop(handle, None)
+            alias = self._get_handle_alias(handle, contact)
+            if self._signalled_aliases.get(handle, None) == alias:
+                continue
+            self._signalled_aliases[handle] = alias
+            logger.info("Contact %s alias changed to '%s'" %
+                    (unicode(handle), alias))
+            aliases.append((handle, alias))
+
+        if aliases:
+            self.AliasesChanged(aliases)
@@ -0,0 +1,176 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+import os
+import tempfile
+import time
+
+__all__ = ['ButterflyAvatarCache', 'get_avatar_cache']
+
+logger = logging.getLogger('Butterfly.AvatarCache')
+
+# Maximum size (in bytes) of the avatars kept on disk
+AVATAR_CACHE_MAX_SIZE = 20 * 1024 * 1024
+
+
+def _default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME', None)
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'telepathy', 'avatars', 'butterfly')
+
+
+class ButterflyAvatarCache(object):
+    """Avatars stored on disk, by token.
+
+    The avatar token is the hex SHA1 of the avatar data, so an avatar is
+    stored once whichever contact uses it and never needs to be
+    invalidated. The least recently used avatars are removed when the
+    total size goes over `max_size`."""
+
+    def __init__(self, path=None, max_size=AVATAR_CACHE_MAX_SIZE):
+        if path is None:
+            path = _default_cache_dir()
+        self._path = path
+        self._max_size = max_size
+        self._entries = {} # token -> [size, last use]
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def __contains__(self, token):
+        return token in self._entries
+
+    def get(self, token):
+        """Get the data of the avatar with the given token, or None."""
+        entry = self._entries.get(token, None)
+        if entry is not None:
+            try:
+                data = self._read(token)
+            except (IOError, OSError), e:
+                logger.warning("Failed to read avatar %s: %s" % (token, e))
+                self._remove(token)
+            else:
+                self.hits += 1
+                entry[1] = time.time()
+                return data
+        self.misses += 1
+        return None
+
+    def get_path(self, token):
+        """Get the path of the file holding the avatar with the given
+        token, or None. The file is only replaced, never modified, so it
+        can be handed to other processes."""
+        entry = self._entries.get(token, None)
+        if entry is not None:
+            path = os.path.join(self._path, token)
+            try:
+                os.utime(path, None)
+            except OSError, e:
+                logger.warning("Failed to find avatar %s: %s" % (token, e))
+                self._remove(token)
+            else:
+                self.hits += 1
+                entry[1] = time.time()
+                return path
+        self.misses += 1
+        return None
+
+    def put(self, token, data):
+        """Store the data of the avatar with the given token."""
+        if not token or token in self._entries or len(data) > self._max_size:
+            return
+        try:
+            self._write(token, data)
+        except (IOError, OSError), e:
+            logger.warning("Failed to store avatar %s: %s" % (token, e))
+            return
+        self._entries[token] = [len(data), time.time()]
+        self._size += len(data)
+        self._evict()
+
+    def _load(self):
+        try:
+            names = os.listdir(self._path)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith('.'):
+                continue # unfinished write
+            try:
+                stat = os.stat(os.path.join(self._path, name))
+            except OSError:
+                continue
+            self._entries[name] = [stat.st_size, stat.st_mtime]
+            self._size += stat.st_size
+        self._evict()
+
+    def _read(self, token):
+        path = os.path.join(self._path, token)
+        f = open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        # The modification time keeps the use order across restarts
+        os.utime(path, None)
+        return data
+
+    def _write(self, token, data):
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path, 0700)
+        fd, tmp_path = tempfile.mkstemp(prefix='.', dir=self._path)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmp_path, os.path.join(self._path, token))
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    def _remove(self, token):
+        size, last_use = self._entries.pop(token)
+        self._size -= size
+        try:
+            os.unlink(os.path.join(self._path, token))
+        except OSError:
+            pass
+
+    def _evict(self):
+        if self._size <= self._max_size:
+            return
+        tokens = sorted(self._entries.keys(),
+                key=lambda token: self._entries[token][1])
+        for token in tokens:
+            if self._size <= self._max_size:
+                break
+            logger.debug("Evicting avatar %s" % token)
+            self._remove(token)
+
+
+_avatar_cache = None
+
+def get_avatar_cache():
+    """Get the avatar cache shared by all the connections."""
+    global _avatar_cache
+    if _avatar_cache is None:
+        _avatar_cache = ButterflyAvatarCache()
+    return _avatar_cache
@@ -0,0 +1,176 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+import weakref
+from collections import deque
+
+import telepathy
+
+__all__ = ['ButterflyAvatarFetcher']
+
+logger = logging.getLogger('Butterfly.AvatarFetcher')
+
+# Default maximum number of avatar transfers running at once
+MAX_AVATAR_FETCHES_IN_FLIGHT = 3
+
+
+class ButterflyAvatarFetcher(object):
+    """Schedule the avatar transfers of a connection.
+
+    Requests are coalesced by token, so that an avatar used by several
+    contacts is only transferred once, and each handle only waits for the
+    latest avatar requested for it. At most `max_in_flight` transfers run
+    at once; the avatars of contacts we have a text channel with go before
+    the others.
+
+    Avatars can also be prefetched, with nobody waiting for them.
+
+    When a transfer completes, `retrieved_cb(token, msn_object, handles)`
+    is called with all the handles waiting for that avatar."""
+
+    def __init__(self, connection, retrieved_cb,
+            max_in_flight=MAX_AVATAR_FETCHES_IN_FLIGHT):
+        self._conn_ref = weakref.ref(connection)
+        self._retrieved_cb = retrieved_cb
+        self._max_in_flight = max(1, max_in_flight)
+
+        self._waiters = {} # token -> set of handles
+        self._handle_tokens = {} # handle -> token
+        self._queued = {} # token -> (msn_object, peer, urgent)
+        self._urgent = deque()
+        self._normal = deque()
+        self._in_flight = set()
+
+    @property
+    def pending(self):
+        """Number of transfers queued or running"""
+        return len(self._queued) + len(self._in_flight)
+
+    def request(self, handle, contact):
+        msn_object = contact.msn_object
+        token = msn_object._data_sha.encode("hex")
+
+        old_token = self._handle_tokens.get(handle, None)
+        if old_token is not None and old_token != token:
+            self._discard_waiter(old_token, handle)
+        self._handle_tokens[handle] = token
+        self._waiters.setdefault(token, set()).add(handle)
+
+        if token in self._in_flight:
+            return
+
+        urgent = self._has_text_channel(handle)
+        queued = self._queued.get(token, None)
+        if queued is not None:
+            if urgent and not queued[2]:
+                # Promoted, the entry left in the normal queue is skipped
+                self._queued[token] = (queued[0], queued[1], True)
+                self._urgent.append(token)
+            return
+
+        self._queued[token] = (msn_object, contact, urgent)
+        if urgent:
+            self._urgent.append(token)
+        else:
+            self._normal.append(token)
+        self._process()
+
+    def prefetch(self, contact):
+        """Fetch the avatar of a contact before anybody asks for it."""
+        msn_object = contact.msn_object
+        token = msn_object._data_sha.encode("hex")
+        if token in self._in_flight or token in self._queued:
+            return
+        self._waiters.setdefault(token, set())
+        self._queued[token] = (msn_object, contact, False)
+        self._normal.append(token)
+        self._process()
+
+    def cancel(self):
+        """Forget about the requests which are not running yet."""
+        self._queued = {}
+        self._urgent.clear()
+        self._normal.clear()
+        for token in self._waiters.keys():
+            if token not in self._in_flight:
+                self._drop_token(token)
+
+    def _has_text_channel(self, handle):
+        conn = self._conn_ref()
+        props = conn._generate_props(telepathy.CHANNEL_TYPE_TEXT, handle,
+                False)
+        return conn._channel_manager.channel_exists(props)
+
+    def _discard_waiter(self, token, handle):
+        waiters = self._waiters.get(token, None)
+        if waiters is None:
+            return
+        waiters.discard(handle)
+        if not waiters and token not in self._in_flight:
+            # Nobody wants it anymore, leave it in the queues to be skipped
+            del self._waiters[token]
+            self._queued.pop(token, None)
+
+    def _drop_token(self, token):
+        for handle in self._waiters.pop(token, ()):
+            if self._handle_tokens.get(handle, None) == token:
+                del self._handle_tokens[handle]
+
+    def _next_token(self):
+        while self._urgent:
+            token = self._urgent.popleft()
+            queued = self._queued.get(token, None)
+            if queued is not None:
+                return token, queued
+        while self._normal:
+            token = self._normal.popleft()
+            queued = self._queued.get(token, None)
+            if queued is not None and not queued[2]:
+                return token, queued
+        return None, None
+
+    def _process(self):
+        while len(self._in_flight) < self._max_in_flight:
+            token, queued = self._next_token()
+            if token is None:
+                break
+            del self._queued[token]
+            msn_object, peer, urgent = queued
+
+            logger.debug("Fetching avatar %s" % token)
+            self._in_flight.add(token)
+            client = self._conn_ref().msn_client
+            client.msn_object_store.request(msn_object,
+                    (self._fetch_done, token),
+                    errback=(self._fetch_failed, token),
+                    peer=peer)
+
+    def _fetch_done(self, msn_object, token):
+        self._complete(token, msn_object)
+
+    def _fetch_failed(self, *args):
+        token = args[-1]
+        logger.warning("Failed to fetch avatar %s: %s" % (token, args[:-1]))
+        self._complete(token, None)
+
+    def _complete(self, token, msn_object):
+        self._in_flight.discard(token)
+        handles = self._waiters.get(token, set())
+        self._drop_token(token)
+        if msn_object is not None:
+            self._retrieved_cb(token, msn_object, handles)
+        self._process()
@@ -0,0 +1,93 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Butterfly specific extension to the Avatars interface, giving access to
+# the avatar files of the cache so that the avatar data doesn't have to
+# go through the bus.
+
+import logging
+import imghdr
+import os
+
+import dbus
+import dbus.service
+import telepathy
+
+__all__ = ['ButterflyAvatarFiles']
+
+logger = logging.getLogger('Butterfly.AvatarFiles')
+
+CONNECTION_INTERFACE_AVATAR_FILES = \
+    'org.freedesktop.Telepathy.Connection.Interface.Butterfly.AvatarFiles'
+
+
+class ConnectionInterfaceAvatarFiles(dbus.service.Interface):
+    """The D-Bus skeleton of the AvatarFiles extension interface.
+
+    GetAvatarFile returns the path of the cached avatar with the given
+    token, and its MIME type. OpenAvatarFile returns a read only file
+    descriptor instead, for clients which can't access our files. Both
+    raise NotAvailable if the avatar isn't cached yet; RequestAvatars
+    fetches it."""
+
+    def __init__(self):
+        self._interfaces.add(CONNECTION_INTERFACE_AVATAR_FILES)
+
+    @dbus.service.method(CONNECTION_INTERFACE_AVATAR_FILES, in_signature='s',
+            out_signature='ss')
+    def GetAvatarFile(self, token):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_AVATAR_FILES, in_signature='s',
+            out_signature='hs')
+    def OpenAvatarFile(self, token):
+        raise telepathy.NotImplemented
+
+
+class ButterflyAvatarFiles(ConnectionInterfaceAvatarFiles):
+    """Avatars handed out as files of the avatar cache.
+
+    The cache is addressed by token, so a client which already knows the
+    token of an avatar can read it without the data being marshalled over
+    the bus. Relies on the cache set up by ButterflyAvatars."""
+
+    def __init__(self):
+        ConnectionInterfaceAvatarFiles.__init__(self)
+
+    def GetAvatarFile(self, token):
+        return self._get_avatar_file(token)
+
+    def OpenAvatarFile(self, token):
+        UnixFd = getattr(dbus.types, 'UnixFd', None)
+        if UnixFd is None:
+            raise telepathy.NotImplemented(
+                    "dbus-python doesn't support file descriptor passing")
+
+        path, mime_type = self._get_avatar_file(token)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            # UnixFd dups the descriptor
+            return (UnixFd(fd), mime_type)
+        finally:
+            os.close(fd)
+
+    def _get_avatar_file(self, token):
+        path = self._avatar_cache.get_path(str(token))
+        if path is None:
+            raise telepathy.NotAvailable("Avatar %s isn't cached" % token)
+        type = imghdr.what(path)
+        if type is None: type = 'jpeg'
+        return (path, 'image/' + type)
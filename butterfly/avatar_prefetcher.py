@@ -0,0 +1,132 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+import time
+import weakref
+from collections import deque
+
+import gobject
+import papyon
+
+__all__ = ['ButterflyAvatarPrefetcher']
+
+logger = logging.getLogger('Butterfly.AvatarPrefetcher')
+
+# Maximum number of transfers running when a prefetch is started
+PREFETCH_MAX_IN_FLIGHT = 1
+
+# Delay (in seconds) without messages or file transfer data before
+# prefetching goes on
+PREFETCH_QUIET_DELAY = 10
+
+# Delay (in milliseconds) between two checks while the fetcher is busy
+PREFETCH_POLL_DELAY = 1000
+
+
+class ButterflyAvatarPrefetcher(object):
+    """Fill the avatar cache in the background.
+
+    Once started, the avatars of the online contacts of the list which are
+    not in the cache are handed one at a time to the avatar fetcher, at low
+    priority and only when it is not busy with requested avatars. The
+    prefetcher pauses while messages or file transfer data flow, see
+    notify_traffic, and stops once it has nothing left to fetch."""
+
+    def __init__(self, connection, fetcher, cache, enabled):
+        self._conn_ref = weakref.ref(connection)
+        self._fetcher = fetcher
+        self._cache = cache
+        self._enabled = enabled
+        self._running = False
+        self._contacts = deque()
+        self._quiet_after = 0
+        self._source = 0
+
+    def start(self):
+        if not self._enabled or self._running:
+            return
+        self._running = True
+        client = self._conn_ref().msn_client
+        for contact in client.address_book.contacts:
+            self._add(contact)
+        logger.info("Prefetching %d avatars" % len(self._contacts))
+        self._schedule()
+
+    def stop(self):
+        self._running = False
+        self._contacts.clear()
+        if self._source != 0:
+            gobject.source_remove(self._source)
+            self._source = 0
+
+    def add(self, contact):
+        """Prefetch the new avatar of a contact."""
+        if self._running and self._add(contact):
+            self._schedule()
+
+    def notify_traffic(self):
+        """Hold prefetching back, messages or file transfers are going on."""
+        if self._running:
+            self._quiet_after = time.time() + PREFETCH_QUIET_DELAY
+
+    def _add(self, contact):
+        if not self._wanted(contact):
+            return False
+        self._contacts.append(contact)
+        return True
+
+    def _wanted(self, contact):
+        msn_object = contact.msn_object
+        if msn_object is None or \
+                contact.presence == papyon.Presence.OFFLINE or \
+                not contact.is_member(papyon.Membership.FORWARD):
+            return False
+        return msn_object._data_sha.encode("hex") not in self._cache
+
+    def _schedule(self, delay=0):
+        if self._source != 0:
+            return
+        if delay > 0:
+            self._source = gobject.timeout_add(delay, self._step,
+                    priority=gobject.PRIORITY_LOW)
+        else:
+            self._source = gobject.idle_add(self._step,
+                    priority=gobject.PRIORITY_LOW)
+
+    def _step(self):
+        self._source = 0
+
+        quiet_delay = self._quiet_after - time.time()
+        if quiet_delay > 0:
+            self._schedule(int(quiet_delay * 1000))
+            return False
+        if self._fetcher.pending >= PREFETCH_MAX_IN_FLIGHT:
+            self._schedule(PREFETCH_POLL_DELAY)
+            return False
+
+        while self._contacts:
+            contact = self._contacts.popleft()
+            # The contact may have gone offline or changed avatar since
+            if self._wanted(contact):
+                self._fetcher.prefetch(contact)
+                break
+
+        if self._contacts:
+            self._schedule(PREFETCH_POLL_DELAY)
+        else:
+            logger.info("Avatar prefetching done")
+        return False
@@ -19,6 +19,7 @@
 import logging
 import imghdr
 import hashlib
+import cStringIO
 import dbus
 
 import telepathy
@@ -27,11 +28,26 @@ import papyon.event
 import papyon.util.string_io as StringIO
 
 from butterfly.util.decorator import async
+from butterfly.util.worker import ThreadWorker
+from butterfly.avatar_cache import get_avatar_cache
+from butterfly.avatar_fetcher import ButterflyAvatarFetcher
+from butterfly.avatar_prefetcher import ButterflyAvatarPrefetcher
+from butterfly.self_avatar import ButterflySelfAvatarStore
 
 __all__ = ['ButterflyAvatars']
 
 logger = logging.getLogger('Butterfly.Avatars')
 
+# PIL is optional, it is only needed to normalise our avatars when the
+# avatar-normalize parameter is set
+try:
+    import Image
+except ImportError:
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+
 SUPPORTED_AVATAR_MIME_TYPES = dbus.Array(["image/png", "image/jpeg",
     "image/gif"], signature='s')
 MINIMUM_AVATAR_PIXELS = dbus.UInt32(96)
@@ -39,16 +55,87 @@ RECOMMENDED_AVATAR_PIXELS = dbus.UInt32(96)
 MAXIMUM_AVATAR_PIXELS = dbus.UInt32(192)
 MAXIMUM_AVATAR_BYTES = dbus.UInt32(500 * 1024)
 
+# Number of bytes looked at to find out the type of an image
+IMAGE_HEADER_SIZE = 32
+
+# Quality of the JPEG images re-encoded by _normalize_avatar
+AVATAR_JPEG_QUALITY = 85
+
+# Image work and hashing of our own avatars is done in this thread
+_avatar_worker = ThreadWorker('butterfly-avatars')
+
+
+def _normalize_avatar(avatar):
+    """Downscale and re-encode an avatar which is bigger than what we
+    advertise. Runs in the avatar worker thread."""
+    if Image is None:
+        return avatar
+
+    try:
+        image = Image.open(cStringIO.StringIO(avatar))
+        width, height = image.size
+    except Exception, e:
+        logger.warning("Can't decode avatar, using it as is: %s" % e)
+        return avatar
+
+    if max(width, height) <= MAXIMUM_AVATAR_PIXELS and \
+            len(avatar) <= MAXIMUM_AVATAR_BYTES:
+        return avatar
+
+    image.thumbnail((MAXIMUM_AVATAR_PIXELS, MAXIMUM_AVATAR_PIXELS),
+            Image.ANTIALIAS)
+    output = cStringIO.StringIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(output, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(output, 'JPEG',
+                quality=AVATAR_JPEG_QUALITY, optimize=True)
+    normalized = output.getvalue()
+    logger.info("Avatar downscaled from %dx%d (%d bytes) to %dx%d (%d bytes)" %
+            (width, height, len(avatar), image.size[0], image.size[1],
+                len(normalized)))
+    return normalized
+
+
+def _new_avatar_msn_object(profile, sha, data):
+    """Build the MSNObject of our avatar from its SHA1 digest, so that
+    papyon doesn't hash the data again."""
+    return papyon.p2p.MSNObject(profile,
+                     len(data),
+                     papyon.p2p.MSNObjectType.DISPLAY_PICTURE,
+                     sha.encode("hex") + '.tmp',
+                     "",
+                     shad=sha,
+                     data=data)
+
+
+def _prepare_avatar(avatar, store, normalize):
+    """Normalise if asked to, hash and store our avatar. Runs in the avatar
+    worker thread, the MSNObject is built back in the mainloop."""
+    if normalize:
+        avatar = _normalize_avatar(avatar)
+    sha = hashlib.sha1(avatar).digest()
+    try:
+        data = store.save(sha.encode("hex"), avatar)
+    except (IOError, OSError, ValueError), e:
+        logger.warning("Failed to store self avatar: %s" % e)
+        data = StringIO.StringIO(avatar)
+    return (sha, data, avatar)
+
+
 class ButterflyAvatars(\
-        telepathy.server.ConnectionInterfaceAvatars,
-        papyon.event.ContactEventInterface,
-        papyon.event.ProfileEventInterface):
+        telepathy.server.ConnectionInterfaceAvatars):
 
     def __init__(self):
         self._avatar_known = False
+        self._avatar_cache = get_avatar_cache()
+        self._self_avatar_store = ButterflySelfAvatarStore(self._account[0])
+        self._avatar_fetcher = ButterflyAvatarFetcher(self,
+                self._avatar_fetched, self._avatar_fetch_limit)
+        self._avatar_prefetcher = ButterflyAvatarPrefetcher(self,
+                self._avatar_fetcher, self._avatar_cache,
+                self._avatar_prefetch)
         telepathy.server.ConnectionInterfaceAvatars.__init__(self)
-        papyon.event.ContactEventInterface.__init__(self, self.msn_client)
-        papyon.event.ProfileEventInterface.__init__(self, self.msn_client)
 
         dbus_interface = telepathy.CONNECTION_INTERFACE_AVATARS
         self._implement_property_get(dbus_interface, {
@@ -73,18 +160,23 @@ class ButterflyAvatars(\
         result = {}
         for handle_id in contacts:
             handle = self.handle(telepathy.HANDLE_TYPE_CONTACT, handle_id)
-            contact = handle.contact
+            token = self._get_avatar_token(handle.contact)
+            if token is not None:
+                result[handle] = token
+        return result
 
-            if contact is not None:
-                msn_object = contact.msn_object
-            else:
-                msn_object = None
+    def _get_avatar_token(self, contact):
+        """Get the avatar token of a contact, or None if it is unknown"""
+        if contact is not None:
+            msn_object = contact.msn_object
+        else:
+            msn_object = None
 
-            if msn_object is not None:
-                result[handle] = msn_object._data_sha.encode("hex")
-            elif self._avatar_known:
-                result[handle] = ""
-        return result
+        if msn_object is not None:
+            return msn_object._data_sha.encode("hex")
+        elif self._avatar_known:
+            return ""
+        return None
 
     def RequestAvatars(self, contacts):
         for handle_id in contacts:
@@ -93,41 +185,93 @@ class ButterflyAvatars(\
                 contact = self.msn_client.profile
             else:
                 contact = handle.contact
-            if contact is not None:
-                msn_object = contact.msn_object
-                self.msn_client.msn_object_store.request(msn_object,
-                        (self._msn_object_retrieved, handle), peer=contact)
+            if contact is None or contact.msn_object is None:
+                continue
+
+            msn_object = contact.msn_object
+            token = msn_object._data_sha.encode("hex")
+            avatar = self._avatar_cache.get(token)
+            if avatar is not None:
+                logger.debug("Avatar %s found in cache" % token)
+                self._avatar_retrieved([handle], token, avatar)
+                continue
 
-    def SetAvatar(self, avatar, mime_type):
+            self._avatar_fetcher.request(handle, contact)
+
+    # Overwrite the dbus attribute to get the avatar as a string, and to
+    # reply once the avatar is processed
+    @dbus.service.method(telepathy.CONNECTION_INTERFACE_AVATARS,
+            in_signature='ays', out_signature='s', byte_arrays=True,
+            async_callbacks=('_success', '_error'))
+    def SetAvatar(self, avatar, mime_type, _success, _error):
         self._avatar_known = True
         if not isinstance(avatar, str):
-            avatar = "".join([chr(b) for b in avatar])
-        msn_object = papyon.p2p.MSNObject(self.msn_client.profile,
-                         len(avatar),
-                         papyon.p2p.MSNObjectType.DISPLAY_PICTURE,
-                         hashlib.sha1(avatar).hexdigest() + '.tmp',
-                         "",
-                         data=StringIO.StringIO(avatar))
-        self.msn_client.profile.msn_object = msn_object
-        avatar_token = msn_object._data_sha.encode("hex")
-        logger.info("Setting self avatar to %s" % avatar_token)
-        return avatar_token
-
-    def ClearAvatar(self):
-        self.msn_client.profile.msn_object = None
+            avatar = str(bytearray(avatar))
+
+        def built_cb((sha, data, avatar)):
+            profile = self.msn_client.profile
+            profile.msn_object = _new_avatar_msn_object(profile, sha, data)
+            avatar_token = sha.encode("hex")
+            self._avatar_cache.put(avatar_token, avatar)
+            logger.info("Setting self avatar to %s" % avatar_token)
+            _success(avatar_token)
+
+        def failed_cb(error):
+            logger.warning("Failed to set self avatar: %s" % error)
+            _error(telepathy.NotAvailable(str(error)))
+
+        _avatar_worker.run(_prepare_avatar,
+                (avatar, self._self_avatar_store, self._avatar_normalize),
+                built_cb, failed_cb)
+
+    # Overwrite the dbus attribute to reply once the avatar is cleared
+    @dbus.service.method(telepathy.CONNECTION_INTERFACE_AVATARS,
+            in_signature='', out_signature='',
+            async_callbacks=('_success', '_error'))
+    def ClearAvatar(self, _success, _error):
+        self._avatar_known = True
+
+        def cleared_cb(result):
+            self.msn_client.profile.msn_object = None
+            logger.info("Self avatar cleared")
+            _success()
+
+        def failed_cb(error):
+            logger.warning("Failed to clear self avatar: %s" % error)
+            _error(telepathy.NotAvailable(str(error)))
+
+        # Queued behind the SetAvatar calls still being processed, so that
+        # they can't bring the avatar back once it is cleared
+        _avatar_worker.run(self._self_avatar_store.clear, (),
+                cleared_cb, failed_cb)
+
+    def _restore_self_avatar(self):
+        """Put back the avatar stored by a previous connection, unless one
+        was set since. Called before the connection is opened so that our
+        first presence already carries it."""
+        if self._avatar_known or self.msn_client.profile.msn_object is not None:
+            return
+        stored = self._self_avatar_store.load()
+        if stored is None:
+            return
+        token, data = stored
+        logger.info("Restoring self avatar %s" % token)
         self._avatar_known = True
+        self.msn_client.profile.msn_object = _new_avatar_msn_object(
+                self.msn_client.profile, token.decode("hex"), data)
 
-    # papyon.event.ContactEventInterface
-    def on_contact_msn_object_changed(self, contact):
+    # Dispatched by ButterflyEventDispatcher
+    def _contact_avatar_changed(self, handle, contact):
         if contact.msn_object is not None:
             avatar_token = contact.msn_object._data_sha.encode("hex")
         else:
             avatar_token = ""
-        handle = self.ensure_contact_handle(contact)
         self.AvatarUpdated(handle, avatar_token)
+        if contact.msn_object is not None:
+            self._avatar_prefetcher.add(contact)
 
-    # papyon.event.ProfileEventInterface
-    def on_profile_msn_object_changed(self):
+    # Dispatched by ButterflyEventDispatcher
+    def _profile_avatar_changed(self):
         msn_object = self.msn_client.profile.msn_object
         if msn_object is not None:
             avatar_token = msn_object._data_sha.encode("hex")
@@ -136,16 +280,22 @@ class ButterflyAvatars(\
             self.AvatarUpdated(handle, avatar_token)
 
     @async
-    def _msn_object_retrieved(self, msn_object, handle):
-        if msn_object is not None and msn_object._data is not None:
-            logger.info("Avatar retrieved %s" % msn_object._data_sha.encode("hex"))
+    def _avatar_fetched(self, token, msn_object, handles):
+        if msn_object._data is not None:
+            logger.info("Avatar retrieved %s" % token)
             msn_object._data.seek(0, 0)
             avatar = msn_object._data.read()
             msn_object._data.seek(0, 0)
-            type = imghdr.what('', avatar)
-            if type is None: type = 'jpeg'
-            avatar = dbus.ByteArray(avatar)
-            token = msn_object._data_sha.encode("hex")
-            self.AvatarRetrieved(handle, token, avatar, 'image/' + type)
+            self._avatar_cache.put(token, avatar)
+            self._avatar_retrieved(handles, token, avatar)
         else:
             logger.info("Avatar retrieved but NULL")
+
+    def _avatar_retrieved(self, handles, token, avatar):
+        if not handles:
+            return # prefetched
+        type = imghdr.what('', avatar[:IMAGE_HEADER_SIZE])
+        if type is None: type = 'jpeg'
+        # dbus-python sends a str as a byte array, no need to copy it
+        for handle in handles:
+            self.AvatarRetrieved(handle, token, avatar, 'image/' + type)
@@ -23,16 +23,22 @@ import telepathy
 import papyon
 import papyon.event
 
-from butterfly.util.decorator import async
+from butterfly.util.idle import IdleBatcher, IdleSlicer
 
 __all__ = ['ButterflyCapabilities']
 
 logger = logging.getLogger('Butterfly.Capabilities')
 
+# Maximum time (in seconds) spent on each slice of _populate_capabilities
+CAPABILITIES_SLICE_BUDGET = 0.01
+
+# Delay (in milliseconds) during which the clients calling UpdateCapabilities
+# are collected before our own capabilities are advertised
+CAPABILITIES_SETTLE_DELAY = 500
+
 class ButterflyCapabilities(
         telepathy.server.ConnectionInterfaceCapabilities,
-        telepathy.server.ConnectionInterfaceContactCapabilities,
-        papyon.event.ContactEventInterface):
+        telepathy.server.ConnectionInterfaceContactCapabilities):
 
     text_chat_class = \
         ({telepathy.CHANNEL_INTERFACE + '.ChannelType':
@@ -73,32 +79,45 @@ class ButterflyCapabilities(
           telepathy.CHANNEL_TYPE_FILE_TRANSFER + '.Size',
           telepathy.CHANNEL_TYPE_FILE_TRANSFER + '.ContentType'])
 
+    # Requestable channel classes by client capabilities fingerprint, shared
+    # by all the contacts, see _get_contact_capabilities
+    _interned_contact_caps = {}
+
 
     def __init__(self):
         telepathy.server.ConnectionInterfaceCapabilities.__init__(self)
         telepathy.server.ConnectionInterfaceContactCapabilities.__init__(self)
-        papyon.event.ContactEventInterface.__init__(self, self.msn_client)
 
-        self._video_clients = []
-        self._update_capabilities_calls = []
+        self._capabilities_populator = None
+
+        # Clients handling video calls, and the ones which called
+        # UpdateCapabilities during the settle delay
+        self._video_clients = set()
+        self._advertisement_pending = False
+        self._video_clients_batcher = IdleBatcher(
+                self._video_clients_changed, CAPABILITIES_SETTLE_DELAY)
+
+        # Capability changes are signalled once per mainloop iteration
+        self._capabilities_batcher = IdleBatcher(
+                self._emit_capabilities_changed)
+        self._contact_capabilities_batcher = IdleBatcher(
+                self._emit_contact_capabilities_changed)
 
 
     ### Events handling ------------------------------------------------------
 
-    # papyon.event.ContactEventInterface
-    def on_contact_client_capabilities_changed(self, contact):
-        handle = self.ensure_contact_handle(contact)
+    # Dispatched by ButterflyEventDispatcher
+    def _contact_capabilities_changed(self, handle, contact):
         if handle == self._self_handle:
             return # don't update our own capabilities using server ones
         self._update_capabilities(handle)
         self._update_contact_capabilities([handle])
 
-    # papyon.event.AddressBookEventInterface
-    def on_addressbook_contact_added(self, contact):
+    # Dispatched by ButterflyEventDispatcher
+    def _contact_added_capabilities(self, handle, contact):
         """When we add a contact in our contact list, add the
         default capabilities to the contact"""
         if contact.is_member(papyon.Membership.FORWARD):
-            handle = self.ensure_contact_handle(contact)
             self._add_default_capabilities([handle])
             self._update_contact_capabilities([handle])
 
@@ -122,27 +141,54 @@ class ButterflyCapabilities(
 
     def _add_default_capabilities(self, handles):
         """Add the default capabilities to these contacts."""
-        ret = []
         for handle in handles:
             new_flag = telepathy.CONNECTION_CAPABILITY_FLAG_CREATE
 
             ctype = telepathy.CHANNEL_TYPE_TEXT
             diff = self._diff_capabilities(handle, ctype, added_gen=new_flag)
-            ret.append(diff)
+            self._queue_capabilities_diff(diff)
 
             ctype = telepathy.CHANNEL_TYPE_FILE_TRANSFER
             diff = self._diff_capabilities(handle, ctype, added_gen=new_flag)
-            ret.append(diff)
+            self._queue_capabilities_diff(diff)
 
-        self.CapabilitiesChanged(ret)
+    def _get_handle_capabilities(self, handle):
+        """Get the GetCapabilities structures of one handle"""
+        caps = dbus.Array([], signature='(usuu)')
+        for ctype, (gen_caps, spec_caps) in self._caps.get(handle, {}).items():
+            caps.append(dbus.Struct((handle.get_id(), ctype, gen_caps, spec_caps),
+                signature='usuu'))
+        return caps
 
     def _update_capabilities(self, handle):
         ctype = telepathy.CHANNEL_TYPE_STREAMED_MEDIA
 
         new_gen, new_spec = self._get_capabilities(handle.contact)
         diff = self._diff_capabilities(handle, ctype, new_gen, new_spec)
-        if diff is not None:
-            self.CapabilitiesChanged([diff])
+        self._queue_capabilities_diff(diff)
+
+    def _queue_capabilities_diff(self, diff):
+        if diff is None:
+            return
+        handle_id, ctype, old_gen, new_gen, old_spec, new_spec = diff
+        key = (handle_id, ctype)
+        pending = self._capabilities_batcher.get(key)
+        if pending is not None:
+            # Diff against what was there before the first queued change
+            old_gen, old_spec = pending[2], pending[4]
+        self._capabilities_batcher.add(key,
+                (handle_id, ctype, old_gen, new_gen, old_spec, new_spec))
+
+    def _emit_capabilities_changed(self, changes):
+        diffs = []
+        for key, diff in changes:
+            handle_id, ctype, old_gen, new_gen, old_spec, new_spec = diff
+            if old_gen == new_gen and old_spec == new_spec:
+                continue # changed back in the meantime
+            diffs.append(diff)
+
+        if diffs:
+            self.CapabilitiesChanged(diffs)
 
 
     ### ContactCapabilities interface ----------------------------------------
@@ -161,10 +207,6 @@ class ButterflyCapabilities(
             AdvertiseCapabilities(self, add, remove)
 
     def UpdateCapabilities(self, caps):
-        if self._status != telepathy.CONNECTION_STATUS_CONNECTED:
-            self._update_capabilities_calls.append(caps)
-            return
-
         # We only care about voip.
         for client, classes, capabilities in caps:
             video = False
@@ -175,71 +217,133 @@ class ButterflyCapabilities(
                     video = True
                     break
 
-            if video and client not in self._video_clients:
-                self._video_clients.append(client)
-            elif not video and client in self._video_clients:
-                # *Did* it used to support video?
-                self._video_clients.remove(client)
+            # Clients tend to register all at once, they are advertised
+            # together once they settle
+            self._video_clients_batcher.add(client, video)
 
-        video = (len(self._video_clients) > 0)
+    def _video_clients_changed(self, changes):
+        for client, video in changes:
+            if video:
+                self._video_clients.add(client)
+            else:
+                # *Did* it used to support video?
+                self._video_clients.discard(client)
+        self._advertisement_pending = True
+
+        # Done once the contacts are populated otherwise
+        if self._status == telepathy.CONNECTION_STATUS_CONNECTED and \
+                self._capabilities_populator is None:
+            self._advertise_capabilities()
+
+    def _advertise_capabilities(self):
+        """Advertise the capabilities of all the registered clients."""
+        self._advertisement_pending = False
+        client_id = self._msn_client.profile.client_id
+        video = bool(self._video_clients)
         changed = False
 
         # We've got no more clients that support video; remove the cap.
-        if not video and not self._video_clients:
-            self._msn_client.profile.client_id.has_webcam = False
+        if not video and client_id.has_webcam:
+            client_id.has_webcam = False
             changed = True
 
         # We want video.
-        if video and (not self._msn_client.profile.client_id.has_webcam or
-           not self._msn_client.profile.client_id.supports_rtc_video):
-            self._msn_client.profile.client_id.has_webcam = True
-            self._msn_client.profile.client_id.supports_rtc_video = True
-            changed = True
+        if video:
+            if not client_id.has_webcam:
+                client_id.has_webcam = True
+                changed = True
+            if not client_id.supports_rtc_video:
+                client_id.supports_rtc_video = True
+                changed = True
 
         # Signal.
         if changed:
-            updated = dbus.Dictionary({self._self_handle: self._contact_caps[self._self_handle]},
-                signature='ua(a{sv}as)')
-            self.ContactCapabilitiesChanged(updated)
+            self._update_contact_capabilities([self._self_handle])
 
     def _get_contact_capabilities(self, contact):
-        contact_caps = []
+        """Get the requestable channel classes of a contact. Contacts with
+        the same capabilities get the same array, which must not be
+        modified."""
         caps = contact.client_capabilities
+        sip = bool(caps.supports_sip_invite)
+        fingerprint = (sip, sip and bool(caps.has_webcam))
+
+        contact_caps = self._interned_contact_caps.get(fingerprint, None)
+        if contact_caps is None:
+            contact_caps = dbus.Array([], signature='(a{sv}as)')
+            contact_caps.append(self.text_chat_class)
+            contact_caps.append(self.file_transfer_class)
+            if caps.supports_sip_invite:
+                if caps.has_webcam:
+                    contact_caps.append(self.av_chat_class)
+                else:
+                    contact_caps.append(self.audio_chat_class)
+            self._interned_contact_caps[fingerprint] = contact_caps
 
-        contact_caps.append(self.text_chat_class)
-        contact_caps.append(self.file_transfer_class)
-        if caps.supports_sip_invite:
-            if caps.has_webcam:
-                contact_caps.append(self.av_chat_class)
-            else:
-                contact_caps.append(self.audio_chat_class)
+        return contact_caps
 
+    def _get_handle_contact_capabilities(self, handle):
+        """Get the requestable channel classes of one handle"""
+        contact_caps = self._contact_caps.get(handle, None)
+        if contact_caps is None:
+            contact_caps = dbus.Array([], signature='(a{sv}as)')
         return contact_caps
 
     def _update_contact_capabilities(self, handles):
-        caps = {}
+        # The getters read the global dict, so it is updated right away and
+        # only the signal waits for the batch
         for handle in handles:
-            caps[handle] = self._get_contact_capabilities(handle.contact)
-            self._contact_caps[handle] = caps[handle] # update global dict
-        ret = dbus.Dictionary(caps, signature='ua(a{sv}as)')
+            contact = handle.contact
+            if contact is None:
+                continue
+            contact_caps = self._get_contact_capabilities(contact)
+            if self._contact_caps.get(handle, None) == contact_caps:
+                continue
+            self._contact_caps[handle] = contact_caps # update global dict
+            self._contact_capabilities_batcher.add(handle, contact_caps)
+
+    def _emit_contact_capabilities_changed(self, changes):
+        ret = dbus.Dictionary(changes, signature='ua(a{sv}as)')
         self.ContactCapabilitiesChanged(ret)
 
 
     ### Initialization -------------------------------------------------------
 
-    @async
     def _populate_capabilities(self):
         """ Add the default capabilities to all contacts in our
-        contacts list."""
-        handles = set([self._self_handle])
-        for contact in self.msn_client.address_book.contacts:
-            if contact.is_member(papyon.Membership.FORWARD):
-                handle = self.ensure_contact_handle(contact)
-                handles.add(handle)
-        self._add_default_capabilities(handles)
-        self._update_contact_capabilities(handles)
-
-        # These caps were updated before we were online.
-        for caps in self._update_capabilities_calls:
-            self.UpdateCapabilities(caps)
-        self._update_capabilities_calls = []
+        contacts list.
+
+        The contacts are handled a slice at a time so that a big contact
+        list doesn't hold the mainloop when the connection opens; the
+        signals go out in chunks as the batchers flush between slices."""
+        self._cancel_capabilities_population()
+        contacts = [self.msn_client.profile]
+        contacts.extend(self.msn_client.address_book.contacts)
+        self._capabilities_populator = IdleSlicer(contacts,
+                self._populate_contact_capabilities,
+                self._capabilities_populated,
+                self._capabilities_slice_size, CAPABILITIES_SLICE_BUDGET)
+        self._capabilities_populator.start()
+
+    def _populate_contact_capabilities(self, contact):
+        if contact is self.msn_client.profile:
+            handle = self._self_handle
+        elif contact.is_member(papyon.Membership.FORWARD):
+            handle = self.ensure_contact_handle(contact)
+        else:
+            return
+        self._add_default_capabilities([handle])
+        self._update_contact_capabilities([handle])
+
+    def _capabilities_populated(self):
+        self._capabilities_populator = None
+
+        # Clients may have registered before we were online.
+        self._video_clients_batcher.flush()
+        if self._advertisement_pending:
+            self._advertise_capabilities()
+
+    def _cancel_capabilities_population(self):
+        if self._capabilities_populator is not None:
+            self._capabilities_populator.cancel()
+            self._capabilities_populator = None
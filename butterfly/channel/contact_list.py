@@ -23,7 +23,6 @@ import telepathy
 import papyon
 import papyon.event
 
-from butterfly.util.decorator import async
 from butterfly.channel import ButterflyChannel
 
 __all__ = ['ButterflyContactListChannelFactory']
@@ -128,7 +127,8 @@ class ButterflyListChannel(
         ButterflyChannel.__init__(self, connection, props)
         telepathy.server.ChannelInterfaceGroup.__init__(self)
         papyon.event.AddressBookEventInterface.__init__(self, connection.msn_client)
-        self._populate(connection)
+        self._roster_partitioner = manager.roster_partitioner
+        self._roster_partitioner.populate(self)
 
     def GetLocalPendingMembersWithInfo(self):
         return []
@@ -165,19 +165,8 @@ class ButterflyListChannel(
     def on_addressbook_contact_unblocked(self, contact):
         pass
 
-    @async
-    def _populate(self, connection):
-        added = set()
-        local_pending = set()
-        remote_pending = set()
-
-        for contact in connection.msn_client.address_book.contacts:
-            ad, lp, rp = self._filter_contact(contact)
-            if ad or lp or rp:
-                handle = self._conn.ensure_contact_handle(contact)
-                if ad: added.add(handle)
-                if lp: local_pending.add(handle)
-                if rp: remote_pending.add(handle)
+    def _members_populated(self, added, local_pending, remote_pending):
+        """Called by the roster partitioner with the initial members."""
         self.MembersChanged('', added, (), local_pending, remote_pending, 0,
                 telepathy.CHANNEL_GROUP_CHANGE_REASON_NONE)
 
@@ -190,8 +179,7 @@ class ButterflyListChannel(
                 (handle in remote_pending)
 
 
-class ButterflySubscribeListChannel(ButterflyListChannel,
-        papyon.event.ContactEventInterface):
+class ButterflySubscribeListChannel(ButterflyListChannel):
     """Subscribe List channel.
 
     This channel contains the list of contact to whom the current used is
@@ -201,7 +189,7 @@ class ButterflySubscribeListChannel(ButterflyListChannel,
     def __init__(self, connection, manager, props):
         ButterflyListChannel.__init__(self, connection, manager, props,
             object_path='RosterChannel/List/subscribe')
-        papyon.event.ContactEventInterface.__init__(self, connection.msn_client)
+        connection.contact_event_router.subscribe_all(self)
         self.GroupFlagsChanged(telepathy.CHANNEL_GROUP_FLAG_CAN_ADD |
                 telepathy.CHANNEL_GROUP_FLAG_CAN_REMOVE, 0)
 
@@ -298,7 +286,7 @@ class ButterflySubscribeListChannel(ButterflyListChannel,
         ab.delete_contact(contact, done_cb=(finished_cb,),
                 failed_cb=(finished_cb,))
 
-    # papyon.event.ContactEventInterface
+    # Routed by ButterflyContactEventRouter
     def on_contact_memberships_changed(self, contact):
         handle = self._conn.ensure_contact_handle(contact)
         if contact.is_member(papyon.Membership.FORWARD):
@@ -311,13 +299,12 @@ class ButterflySubscribeListChannel(ButterflyListChannel,
                 handle.pending_groups = set()
 
 
-class ButterflyPublishListChannel(ButterflyListChannel,
-        papyon.event.ContactEventInterface):
+class ButterflyPublishListChannel(ButterflyListChannel):
 
     def __init__(self, connection, manager, props):
         ButterflyListChannel.__init__(self, connection, manager, props,
             object_path='RosterChannel/List/publish')
-        papyon.event.ContactEventInterface.__init__(self, connection.msn_client)
+        connection.contact_event_router.subscribe_all(self)
         self.GroupFlagsChanged(telepathy.CHANNEL_GROUP_FLAG_CAN_ADD |
                 telepathy.CHANNEL_GROUP_FLAG_CAN_REMOVE, 0)
 
@@ -383,7 +370,7 @@ class ButterflyPublishListChannel(ButterflyListChannel,
         else:
             return True # contact is neither pending or allowed
 
-    # papyon.event.ContactEventInterface
+    # Routed by ButterflyContactEventRouter
     def on_contact_memberships_changed(self, contact):
         handle = self._conn.ensure_contact_handle(contact)
         if self._contains_handle(handle):
@@ -287,6 +287,7 @@ class ButterflyFileTransferChannel(telepathy.server.ChannelTypeFileTransfer):
 
     def _transfer_progressed(self, session, size):
         self._transferred += size
+        self._conn.avatar_prefetcher.notify_traffic()
 
         def emit_signal():
             self.TransferredBytesChanged(self.transferred)
@@ -127,6 +127,7 @@ class ButterflyGroupChannel(ButterflyListChannel,
 
     def on_addressbook_group_deleted(self, group):
         if group.name.decode("utf-8") == self._handle.name:
+            self._roster_partitioner.discard(self)
             self.Closed()
             self._conn.remove_channel(self)
 
@@ -66,6 +66,14 @@ class ButterflyImChannel(ButterflyTextChannel):
 
         self._oim_box_ref = weakref.ref(conn.msn_client.oim_box)
 
+        # Presence changes of our contact bring the conversation back
+        conn.contact_event_router.subscribe(contact, self)
+
+    def Close(self):
+        self._conn.contact_event_router.unsubscribe(
+                self._initial_handle.contact, self)
+        ButterflyTextChannel.Close(self)
+
     def steal_conversation(self):
         # Set offline contact details for this 1-1 chat.
         self._offline_handle = self._initial_handle
@@ -162,7 +170,7 @@ class ButterflyImChannel(ButterflyTextChannel):
         self._offline_handle = self._initial_handle
         self._conversation = None
 
-    # papyon.event.ContactEventInterface
+    # Routed by ButterflyContactEventRouter
     def on_contact_presence_changed(self, contact):
         handle = self._conn.ensure_contact_handle(contact)
         # Recreate a conversation if our contact join
@@ -44,7 +44,6 @@ class ButterflyMediaChannel(
         telepathy.server.ChannelInterfaceGroup,
         telepathy.server.ChannelInterfaceMediaSignalling,
         papyon.event.CallEventInterface,
-        papyon.event.ContactEventInterface,
         papyon.event.MediaSessionEventInterface):
 
     def __init__(self, conn, manager, call, handle, props, object_path=None):
@@ -54,7 +53,7 @@ class ButterflyMediaChannel(
         telepathy.server.ChannelInterfaceGroup.__init__(self)
         telepathy.server.ChannelInterfaceMediaSignalling.__init__(self)
         papyon.event.CallEventInterface.__init__(self, call)
-        papyon.event.ContactEventInterface.__init__(self, conn.msn_client)
+        conn.contact_event_router.subscribe(call.peer, self)
         ButterflyChannel.__init__(self, conn, props)
 
         self._call = call
@@ -195,6 +194,7 @@ class ButterflyMediaChannel(
     #papyon.event.call.CallEventInterface
     def on_call_ended(self):
         logger.info("Call has ended")
+        self._conn.contact_event_router.unsubscribe(self._call.peer, self)
         self._call = None
         telepathy.server.ChannelTypeStreamedMedia.Close(self)
         self._session_handler.remove_from_connection()
@@ -224,7 +224,7 @@ class ButterflyMediaChannel(
         self._session_handler.RemoveStream(handler.id)
         del handler
 
-    #papyon.event.media.ContactEventInterface
+    # Routed by ButterflyContactEventRouter
     def on_contact_presence_changed(self, contact):
         if self._call is not None and contact == self._call.peer and \
            contact.presence == papyon.Presence.OFFLINE:
@@ -0,0 +1,161 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+import weakref
+
+import gobject
+import telepathy
+import papyon
+
+from butterfly.util.idle import IdleSlicer
+
+__all__ = ['ButterflyRosterPartitioner']
+
+logger = logging.getLogger('Butterfly.RosterPartitioner')
+
+# Number of contacts sorted per mainloop iteration
+ROSTER_SLICE_SIZE = 100
+
+
+class ButterflyRosterPartitioner(object):
+    """Compute the initial members of the contact list channels.
+
+    Rather than having every list and group channel walk the whole address
+    book, the channels waiting for their initial members register here and
+    a single pass over the address book sorts each contact into the added,
+    local pending and remote pending sets of all of them. The pass is
+    sliced so that big rosters don't block the mainloop. A pass starts from
+    an idle callback, so that all the channels created together share it;
+    channels which register while a pass is running wait for the next
+    one."""
+
+    def __init__(self, connection):
+        self._conn_ref = weakref.ref(connection)
+        self._waiting = []
+        self._slicer = None
+        self._start_source = 0
+        self._reset()
+
+    def populate(self, channel):
+        """Queue a channel for the next pass; it gets its initial members
+        through its _members_populated method."""
+        self._waiting.append(channel)
+        if self._slicer is None and self._start_source == 0:
+            self._start_source = gobject.idle_add(self._start_timeout)
+
+    def discard(self, channel):
+        """Forget about a channel that is going away."""
+        if channel in self._waiting:
+            self._waiting.remove(channel)
+        if channel in self._lists:
+            self._lists.remove(channel)
+        for name, group_channel in self._groups.items():
+            if group_channel is channel:
+                del self._groups[name]
+        self._members.pop(channel, None)
+
+    def cancel(self):
+        if self._start_source != 0:
+            gobject.source_remove(self._start_source)
+            self._start_source = 0
+        if self._slicer is not None:
+            self._slicer.cancel()
+            self._slicer = None
+        self._waiting = []
+        self._reset()
+
+    def _reset(self):
+        self._lists = []
+        self._groups = {}
+        self._members = {}
+
+    def _start_timeout(self):
+        self._start_source = 0
+        if self._waiting:
+            self._start()
+        return False
+
+    def _start(self):
+        for channel in self._waiting:
+            handle = channel._handle
+            if handle.get_type() == telepathy.HANDLE_TYPE_GROUP:
+                self._groups[handle.name] = channel
+            else:
+                self._lists.append(channel)
+            self._members[channel] = (set(), set(), set())
+        self._waiting = []
+
+        logger.debug("Populating %d contact list channels" %
+                len(self._members))
+        # Walk a copy, the address book may change during the pass
+        contacts = list(self._conn_ref().msn_client.address_book.contacts)
+        self._slicer = IdleSlicer(contacts, self._partition_contact,
+                self._pass_done, ROSTER_SLICE_SIZE)
+        self._slicer.start()
+
+    def _partition_contact(self, contact):
+        targets = []
+        for channel in self._lists:
+            ad, lp, rp = channel._filter_contact(contact)
+            if ad or lp or rp:
+                targets.append((channel, ad, lp, rp))
+
+        # Same rule as ButterflyGroupChannel._filter_contact, but only
+        # looking at the groups the contact is in
+        if self._groups and contact.is_member(papyon.Membership.FORWARD):
+            for group in contact.groups:
+                channel = self._groups.get(group.name.decode("utf-8"), None)
+                if channel is not None:
+                    targets.append((channel, True, False, False))
+
+        if not targets:
+            return
+
+        handle = self._conn_ref().ensure_contact_handle(contact)
+        for channel, ad, lp, rp in targets:
+            added, local_pending, remote_pending = self._members[channel]
+            if ad: added.add(handle)
+            if lp: local_pending.add(handle)
+            if rp: remote_pending.add(handle)
+
+    def _recheck(self, channel, handles):
+        added, local_pending, remote_pending = set(), set(), set()
+        for handle in handles:
+            contact = handle.contact
+            if contact is None:
+                continue
+            ad, lp, rp = channel._filter_contact(contact)
+            if ad: added.add(handle)
+            if lp: local_pending.add(handle)
+            if rp: remote_pending.add(handle)
+        return (added, local_pending, remote_pending)
+
+    def _pass_done(self):
+        members = self._members
+        self._slicer = None
+        self._reset()
+
+        for channel, (added, local_pending, remote_pending) in \
+                members.iteritems():
+            # Contacts sorted early in the pass may have changed since, and
+            # the channel already signalled those changes
+            added, local_pending, remote_pending = self._recheck(channel,
+                    added | local_pending | remote_pending)
+            channel._members_populated(added, local_pending, remote_pending)
+
+        if self._waiting:
+            self._start()
@@ -42,7 +42,6 @@ class ButterflyTextChannel(
         telepathy.server.ChannelTypeText,
         telepathy.server.ChannelInterfaceChatState,
         ChannelInterfaceMessages,
-        papyon.event.ContactEventInterface,
         papyon.event.ConversationEventInterface):
 
     def __init__(self, conn, manager, conversation, props, object_path=None):
@@ -59,7 +58,6 @@ class ButterflyTextChannel(
         ButterflyChannel.__init__(self, conn, props)
         telepathy.server.ChannelInterfaceChatState.__init__(self)
         ChannelInterfaceMessages.__init__(self)
-        papyon.event.ContactEventInterface.__init__(self, conn.msn_client)
 
         self._implement_property_get(CHANNEL_INTERFACE_MESSAGES, {
             'SupportedContentTypes': lambda: ["text/plain"] ,
@@ -150,10 +148,12 @@ class ButterflyTextChannel(
                 'content': text
                }
         message = [headers, body]
+        self._conn.avatar_prefetcher.notify_traffic()
         self.Sent(timestamp, message_type, text)
         self.MessageSent(message, 0, '')
 
     def _signal_text_received(self, id, timestamp, sender, type, flags, sender_nick, text):
+        self._conn.avatar_prefetcher.notify_traffic()
         self.Received(id, timestamp, sender, type, flags, text)
         headers = dbus.Dictionary({dbus.String('message-received') : dbus.UInt64(timestamp),
                    dbus.String('pending-message-id') : dbus.UInt32(id),
@@ -31,6 +31,7 @@ from butterfly.channel.muc import ButterflyMucChannel
 from butterfly.channel.conference import ButterflyConferenceChannel
 from butterfly.channel.file_transfer import ButterflyFileTransferChannel
 from butterfly.channel.media import ButterflyMediaChannel
+from butterfly.channel.roster import ButterflyRosterPartitioner
 from butterfly.handle import ButterflyHandleFactory
 
 __all__ = ['ButterflyChannelManager']
@@ -92,6 +93,16 @@ class ButterflyChannelManager(telepathy.server.ChannelManager):
         self.implement_channel_classes(telepathy.CHANNEL_TYPE_STREAMED_MEDIA, self._get_media_channel)
         self.implement_channel_classes(telepathy.CHANNEL_TYPE_FILE_TRANSFER, self._get_ft_channel)
 
+        self._roster_partitioner = ButterflyRosterPartitioner(connection)
+
+    @property
+    def roster_partitioner(self):
+        return self._roster_partitioner
+
+    def close(self):
+        self._roster_partitioner.cancel()
+        telepathy.server.ChannelManager.close(self)
+
     def _get_list_channel(self, props):
         _, surpress_handler, handle = self._get_type_requested_handle(props)
 
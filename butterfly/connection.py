@@ -28,9 +28,17 @@ import papyon.event
 from butterfly.presence import ButterflyPresence
 from butterfly.aliasing import ButterflyAliasing
 from butterfly.avatars import ButterflyAvatars
+from butterfly.avatar_files import ButterflyAvatarFiles
 from butterfly.capabilities import ButterflyCapabilities
 from butterfly.handle import ButterflyHandleFactory, network_to_extension
 from butterfly.contacts import ButterflyContacts
+from butterfly.contact_list import ButterflyContactList, \
+    CONTACT_LIST_STATE_WAITING, CONTACT_LIST_STATE_SUCCESS
+from butterfly.contact_groups import ButterflyContactGroups
+from butterfly.contact_router import ButterflyContactEventRouter
+from butterfly.profile_updater import ButterflyProfileUpdater
+from butterfly.dispatcher import ButterflyEventDispatcher
+from butterfly.addressbook import ButterflyAddressBookIndex
 from butterfly.channel_manager import ButterflyChannelManager
 from butterfly.mail_notification import ButterflyMailNotification
 
@@ -44,8 +52,11 @@ class ButterflyConnection(telepathy.server.Connection,
         ButterflyPresence,
         ButterflyAliasing,
         ButterflyAvatars,
+        ButterflyAvatarFiles,
         ButterflyCapabilities,
         ButterflyContacts,
+        ButterflyContactList,
+        ButterflyContactGroups,
         ButterflyMailNotification,
         papyon.event.ClientEventInterface,
         papyon.event.InviteEventInterface,
@@ -67,6 +78,11 @@ class ButterflyConnection(telepathy.server.Connection,
 
             # Build the proxies configurations
             self._try_http = parameters['http-method']
+            self._avatar_fetch_limit = parameters['avatar-fetch-limit']
+            self._avatar_prefetch = parameters['avatar-prefetch']
+            self._avatar_normalize = parameters['avatar-normalize']
+            self._capabilities_slice_size = \
+                    parameters['capabilities-slice-size']
             proxy = build_proxy_infos(parameters, 'http')
             if proxy is not None:
                 self._http_proxies = [proxy]
@@ -79,6 +95,16 @@ class ButterflyConnection(telepathy.server.Connection,
             self._use_next_proxy()
 
             self._manager = weakref.proxy(manager)
+
+            # Reverse indexes from papyon contacts and from (account, network)
+            # to contact handles, see ensure_contact_handle
+            self._contact_handles = weakref.WeakKeyDictionary()
+            self._account_handles = {}
+
+            # Contact events for the channels, see ButterflyContactEventRouter
+            self._contact_event_router = ButterflyContactEventRouter()
+            self._profile_updater = ButterflyProfileUpdater(self)
+
             self._new_client(use_http=self._try_http)
             self._account = (parameters['account'].encode('utf-8'),
                     parameters['password'].encode('utf-8'))
@@ -91,8 +117,11 @@ class ButterflyConnection(telepathy.server.Connection,
             ButterflyPresence.__init__(self)
             ButterflyAliasing.__init__(self)
             ButterflyAvatars.__init__(self)
+            ButterflyAvatarFiles.__init__(self)
             ButterflyCapabilities.__init__(self)
             ButterflyContacts.__init__(self)
+            ButterflyContactList.__init__(self)
+            ButterflyContactGroups.__init__(self)
             ButterflyMailNotification.__init__(self)
 
             self_handle = self.create_handle(telepathy.HANDLE_TYPE_CONTACT,
@@ -124,6 +153,10 @@ class ButterflyConnection(telepathy.server.Connection,
             self._msn_client = papyon.Client(self._server, self._proxies,
                 version=18)
 
+        self._address_book_index = ButterflyAddressBookIndex(self._msn_client)
+        self._event_dispatcher = ButterflyEventDispatcher(self,
+                self._msn_client)
+
         papyon.event.ClientEventInterface.__init__(self, self._msn_client)
         papyon.event.InviteEventInterface.__init__(self, self._msn_client)
         papyon.event.OfflineMessagesEventInterface.__init__(self, self._msn_client)
@@ -222,6 +255,22 @@ class ButterflyConnection(telepathy.server.Connection,
     def msn_client(self):
         return self._msn_client
 
+    @property
+    def address_book_index(self):
+        return self._address_book_index
+
+    @property
+    def contact_event_router(self):
+        return self._contact_event_router
+
+    @property
+    def event_dispatcher(self):
+        return self._event_dispatcher
+
+    @property
+    def avatar_prefetcher(self):
+        return self._avatar_prefetcher
+
     def handle(self, handle_type, handle_id):
         self.check_handle(handle_type, handle_id)
         return self._handles[handle_type, handle_id]
@@ -235,6 +284,8 @@ class ButterflyConnection(telepathy.server.Connection,
             raise telepathy.NotAvailable('Handle type unsupported %d' % handle_type)
         logger.info("New Handle %s" % unicode(handle))
         self._handles[handle_type, handle_id] = handle
+        if handle_type == telepathy.HANDLE_TYPE_CONTACT:
+            self._account_handles[handle.account.lower(), handle.network] = handle
         return handle
 
     def is_valid_handle_name(self, handle_type, handle_name):
@@ -259,10 +310,55 @@ class ButterflyConnection(telepathy.server.Connection,
         """Build handle name for contact and ensure handle."""
         if contact is None:
             return telepathy.NoneHandler()
+
+        # Fast path: we already resolved this papyon contact
+        handle = self._contact_handles.get(contact)
+        if handle is not None and self._is_live_handle(handle):
+            return handle
+
         handle_type = telepathy.HANDLE_TYPE_CONTACT
-        extension = network_to_extension.get(contact.network_id, "")
-        handle_name = contact.account.lower() + extension
-        return self.ensure_handle(handle_type, handle_name, contact=contact)
+        key = (contact.account.lower(), contact.network_id)
+        handle = self._account_handles.get(key)
+        if handle is None or not self._is_live_handle(handle):
+            extension = network_to_extension.get(contact.network_id, "")
+            handle_name = key[0] + extension
+            handle = self.ensure_handle(handle_type, handle_name, contact=contact)
+            self._account_handles[key] = handle
+        self._address_book_index.learn_contact(contact)
+        self._contact_handles[contact] = handle
+        return handle
+
+    def _is_live_handle(self, handle):
+        """Check the handle has not been disposed since it was indexed."""
+        return self._handles.get((handle.type, handle.id)) is handle
+
+    def _unindex_contact_handle(self, handle):
+        """Drop a contact handle from the indexes of ensure_contact_handle,
+        which then go through ensure_handle for it again."""
+        key = (handle.account.lower(), handle.network)
+        if self._account_handles.get(key) is handle:
+            del self._account_handles[key]
+        contact = handle._contact
+        if contact is not None and self._contact_handles.get(contact) is handle:
+            del self._contact_handles[contact]
+
+    # Overwrite the dbus attribute to keep the released handles out of the
+    # indexes of ensure_contact_handle
+    @dbus.service.method(telepathy.CONNECTION, in_signature='uau',
+            out_signature='', sender_keyword='sender')
+    def ReleaseHandles(self, handle_type, handles, sender):
+        released = []
+        if handle_type == telepathy.HANDLE_TYPE_CONTACT:
+            for handle_id in handles:
+                handle = self._handles.get((handle_type, handle_id), None)
+                if handle is not None:
+                    released.append(handle)
+
+        telepathy.server.Connection.ReleaseHandles(self, handle_type,
+                handles, sender)
+
+        for handle in released:
+            self._unindex_contact_handle(handle)
 
     def Connect(self):
         if self._status == telepathy.CONNECTION_STATUS_DISCONNECTED:
@@ -280,6 +376,14 @@ class ButterflyConnection(telepathy.server.Connection,
 
     def _disconnected(self):
         logger.info("Disconnected")
+        self._event_dispatcher.log_event_counts()
+        logger.debug("Avatar cache: %d hits, %d misses" %
+                (self._avatar_cache.hits, self._avatar_cache.misses))
+        self._avatar_prefetcher.stop()
+        self._avatar_fetcher.cancel()
+        self._cancel_capabilities_population()
+        self._profile_updater.cancel()
+        self._alias_updates.cancel()
         self.StatusChanged(telepathy.CONNECTION_STATUS_DISCONNECTED,
                 self.__disconnect_reason)
         self._channel_manager.close()
@@ -336,9 +440,12 @@ class ButterflyConnection(telepathy.server.Connection,
 
     # papyon.event.ClientEventInterface
     def on_client_state_changed(self, state):
+        self._address_book_index.on_client_state_changed(state)
+
         if state == papyon.event.ClientState.CONNECTING:
             self.StatusChanged(telepathy.CONNECTION_STATUS_CONNECTING,
                     telepathy.CONNECTION_STATUS_REASON_REQUESTED)
+            self._set_contact_list_state(CONTACT_LIST_STATE_WAITING)
         elif state == papyon.event.ClientState.SYNCHRONIZED:
             handle = self.ensure_handle(telepathy.HANDLE_TYPE_LIST, 'subscribe')
             props = self._generate_props(telepathy.CHANNEL_TYPE_CONTACT_LIST,
@@ -371,6 +478,9 @@ class ButterflyConnection(telepathy.server.Connection,
                 props = self._generate_props(
                     telepathy.CHANNEL_TYPE_CONTACT_LIST, handle, False)
                 self._channel_manager.channel_for_props(props, signal=True)
+
+            self._set_contact_list_state(CONTACT_LIST_STATE_SUCCESS)
+            self._restore_self_avatar()
         elif state == papyon.event.ClientState.OPEN:
             self._populate_capabilities()
             if self._client.profile.profile['EmailEnabled'] == '1':
@@ -389,6 +499,9 @@ class ButterflyConnection(telepathy.server.Connection,
                 self._presence_changed(self._self_handle,
                         self._client.profile.presence,
                         self._client.profile.personal_message)
+
+            # Contacts coming online later are fed by their avatar changes
+            self._avatar_prefetcher.start()
         elif state == papyon.event.ClientState.CLOSED:
             self._disconnected()
 
@@ -0,0 +1,234 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Implementation of the ContactGroups specification at :
+# http://telepathy.freedesktop.org/spec/Connection_Interface_Contact_Groups.html
+
+import logging
+
+import dbus
+import dbus.service
+import telepathy
+
+__all__ = ['ButterflyContactGroups']
+
+logger = logging.getLogger('Butterfly.ContactGroups')
+
+CONNECTION_INTERFACE_CONTACT_GROUPS = \
+    'org.freedesktop.Telepathy.Connection.Interface.ContactGroups'
+
+# Contact_Metadata_Storage_Type
+CONTACT_METADATA_STORAGE_TYPE_NONE = 0
+CONTACT_METADATA_STORAGE_TYPE_SUBSCRIBED_OR_PENDING = 1
+CONTACT_METADATA_STORAGE_TYPE_SUBSCRIBED = 2
+CONTACT_METADATA_STORAGE_TYPE_ANYONE = 3
+
+
+class ConnectionInterfaceContactGroups(dbus.service.Interface):
+    """The D-Bus skeleton of the ContactGroups interface, which is not
+    shipped by the telepathy-python version we depend on."""
+
+    def __init__(self):
+        self._interfaces.add(CONNECTION_INTERFACE_CONTACT_GROUPS)
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_GROUPS, in_signature='uas',
+            out_signature='')
+    def SetContactGroups(self, contact, groups):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_GROUPS, in_signature='sau',
+            out_signature='')
+    def SetGroupMembers(self, group, members):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_GROUPS, in_signature='sau',
+            out_signature='')
+    def AddToGroup(self, group, members):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_GROUPS, in_signature='sau',
+            out_signature='')
+    def RemoveFromGroup(self, group, members):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_GROUPS, in_signature='s',
+            out_signature='')
+    def RemoveGroup(self, group):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_GROUPS, in_signature='ss',
+            out_signature='')
+    def RenameGroup(self, old_name, new_name):
+        raise telepathy.NotImplemented
+
+    @dbus.service.signal(CONNECTION_INTERFACE_CONTACT_GROUPS, signature='auasas')
+    def GroupsChanged(self, contacts, added, removed):
+        pass
+
+    @dbus.service.signal(CONNECTION_INTERFACE_CONTACT_GROUPS, signature='as')
+    def GroupsCreated(self, names):
+        pass
+
+    @dbus.service.signal(CONNECTION_INTERFACE_CONTACT_GROUPS, signature='ss')
+    def GroupRenamed(self, old_name, new_name):
+        pass
+
+    @dbus.service.signal(CONNECTION_INTERFACE_CONTACT_GROUPS, signature='as')
+    def GroupsRemoved(self, names):
+        pass
+
+
+class ButterflyContactGroups(ConnectionInterfaceContactGroups):
+    """Group membership of the whole roster without group channels.
+
+    Group memberships are read from the contact to groups table of the
+    address book index. Edits skip the contacts that are already in the
+    requested state and go through the group channels for the others, so
+    pending groups and contacts behave as they do for the channels."""
+
+    def __init__(self):
+        ConnectionInterfaceContactGroups.__init__(self)
+
+        dbus_interface = CONNECTION_INTERFACE_CONTACT_GROUPS
+        self._implement_property_get(dbus_interface, {
+            'DisjointGroups': lambda: False,
+            'GroupStorage': lambda:
+                dbus.UInt32(CONTACT_METADATA_STORAGE_TYPE_SUBSCRIBED),
+            'Groups': lambda: dbus.Array(
+                self._address_book_index.get_group_names(), signature='s'),
+            })
+
+        self._attribute_getters[dbus_interface] = [
+            ('groups', lambda handle, contact:
+                self._get_contact_group_names(contact))
+            ]
+
+    def SetContactGroups(self, contact, groups):
+        handle = self.handle(telepathy.HANDLE_TYPE_CONTACT, contact)
+        current = dict([(name.lower(), name) for name in
+                self._get_contact_group_names(handle.contact)])
+        wanted = dict([(name.lower(), name) for name in groups])
+
+        for key, name in wanted.iteritems():
+            if key not in current:
+                self._add_to_group(name, [contact])
+        for key, name in current.iteritems():
+            if key not in wanted:
+                self._remove_from_group(name, [contact])
+
+    def SetGroupMembers(self, group, members):
+        wanted = set([self.handle(telepathy.HANDLE_TYPE_CONTACT, member)
+                for member in members])
+        current = set()
+        papyon_group = self._address_book_index.search_group(group)
+        if papyon_group is not None:
+            for contact in self._address_book_index.get_group_contacts(
+                    papyon_group):
+                current.add(self.ensure_contact_handle(contact))
+
+        self._add_to_group(group, [handle.get_id()
+            for handle in wanted - current])
+        self._remove_from_group(group, [handle.get_id()
+            for handle in current - wanted])
+
+    def AddToGroup(self, group, members):
+        self._add_to_group(group, members)
+
+    def RemoveFromGroup(self, group, members):
+        self._remove_from_group(group, members)
+
+    def RemoveGroup(self, group):
+        papyon_group = self._address_book_index.search_group(group)
+        if papyon_group is None:
+            return
+        logger.info("Removing group %s" % group)
+        self.msn_client.address_book.delete_group(papyon_group)
+
+    def RenameGroup(self, old_name, new_name):
+        papyon_group = self._address_book_index.search_group(old_name)
+        if papyon_group is None:
+            raise telepathy.NotAvailable("Group %s doesn't exist" % old_name)
+        if old_name.lower() != new_name.lower() and \
+                self._address_book_index.search_group(new_name) is not None:
+            raise telepathy.NotAvailable("Group %s already exists" % new_name)
+        logger.info("Renaming group %s to %s" % (old_name, new_name))
+        self.msn_client.address_book.rename_group(papyon_group,
+                new_name.encode("utf-8"))
+
+    def _add_to_group(self, name, handle_ids):
+        group = self._address_book_index.search_group(name)
+        if group is not None:
+            handle_ids = [handle_id for handle_id in handle_ids
+                    if not self._is_in_group(handle_id, group)]
+            if not handle_ids:
+                return
+        # Going through the channel also creates missing groups
+        self._get_group_channel(name).AddMembers(handle_ids, u'')
+
+    def _remove_from_group(self, name, handle_ids):
+        group = self._address_book_index.search_group(name)
+        if group is None:
+            return # the channel would create the group
+        handle_ids = [handle_id for handle_id in handle_ids
+                if self._is_in_group(handle_id, group)]
+        if handle_ids:
+            self._get_group_channel(name).RemoveMembers(handle_ids, u'')
+
+    def _is_in_group(self, handle_id, group):
+        handle = self.handle(telepathy.HANDLE_TYPE_CONTACT, handle_id)
+        contact = handle.contact
+        if contact is None:
+            return group in handle.pending_groups
+        return group in self._address_book_index.get_contact_groups(contact)
+
+    def _get_group_channel(self, name):
+        self.check_connected()
+        handle = self.ensure_handle(telepathy.HANDLE_TYPE_GROUP, name)
+        props = self._generate_props(telepathy.CHANNEL_TYPE_CONTACT_LIST,
+            handle, False)
+        return self._channel_manager.channel_for_props(props, signal=True)
+
+    def _get_contact_group_names(self, contact):
+        names = dbus.Array([], signature='s')
+        if contact is not None:
+            index = self._address_book_index
+            for group in index.get_contact_groups(contact):
+                names.append(index.get_group_name(group))
+        return names
+
+    # Dispatched by ButterflyEventDispatcher
+    def _group_added(self, group):
+        name = self._address_book_index.get_group_name(group)
+        self.GroupsCreated([name])
+
+    # Dispatched by ButterflyEventDispatcher
+    def _group_deleted(self, group):
+        self.GroupsRemoved([group.name.decode("utf-8")])
+
+    # Dispatched by ButterflyEventDispatcher
+    def _group_renamed(self, group, old_name):
+        new_name = self._address_book_index.get_group_name(group)
+        self.GroupRenamed(old_name, new_name)
+
+    # Dispatched by ButterflyEventDispatcher
+    def _group_contact_added(self, group, handle):
+        name = self._address_book_index.get_group_name(group)
+        self.GroupsChanged([handle], [name], [])
+
+    # Dispatched by ButterflyEventDispatcher
+    def _group_contact_deleted(self, group, handle):
+        name = self._address_book_index.get_group_name(group)
+        self.GroupsChanged([handle], [], [name])
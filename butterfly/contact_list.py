@@ -0,0 +1,224 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Implementation of the ContactList specification at :
+# http://telepathy.freedesktop.org/spec/Connection_Interface_Contact_List.html
+
+import logging
+
+import dbus
+import dbus.service
+import telepathy
+import papyon
+import papyon.event
+
+__all__ = ['ButterflyContactList']
+
+logger = logging.getLogger('Butterfly.ContactList')
+
+CONNECTION_INTERFACE_CONTACT_LIST = \
+    'org.freedesktop.Telepathy.Connection.Interface.ContactList'
+
+# Contact_List_State
+CONTACT_LIST_STATE_NONE = 0
+CONTACT_LIST_STATE_WAITING = 1
+CONTACT_LIST_STATE_FAILURE = 2
+CONTACT_LIST_STATE_SUCCESS = 3
+
+# Subscription_State
+SUBSCRIPTION_STATE_UNKNOWN = 0
+SUBSCRIPTION_STATE_NO = 1
+SUBSCRIPTION_STATE_REMOVED_REMOTELY = 2
+SUBSCRIPTION_STATE_ASK = 3
+SUBSCRIPTION_STATE_YES = 4
+
+
+class ConnectionInterfaceContactList(dbus.service.Interface):
+    """The D-Bus skeleton of the ContactList interface, which is not shipped
+    by the telepathy-python version we depend on."""
+
+    def __init__(self):
+        self._interfaces.add(CONNECTION_INTERFACE_CONTACT_LIST)
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_LIST, in_signature='asb',
+            out_signature='a{ua{sv}}')
+    def GetContactListAttributes(self, interfaces, hold):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_LIST, in_signature='aus',
+            out_signature='')
+    def RequestSubscription(self, contacts, message):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_LIST, in_signature='au',
+            out_signature='')
+    def AuthorizePublication(self, contacts):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_LIST, in_signature='au',
+            out_signature='')
+    def RemoveContacts(self, contacts):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_LIST, in_signature='au',
+            out_signature='')
+    def Unsubscribe(self, contacts):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_LIST, in_signature='au',
+            out_signature='')
+    def Unpublish(self, contacts):
+        raise telepathy.NotImplemented
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_LIST, in_signature='',
+            out_signature='')
+    def Download(self):
+        raise telepathy.NotImplemented
+
+    @dbus.service.signal(CONNECTION_INTERFACE_CONTACT_LIST, signature='u')
+    def ContactListStateChanged(self, contact_list_state):
+        pass
+
+    @dbus.service.signal(CONNECTION_INTERFACE_CONTACT_LIST, signature='a{u(uus)}au')
+    def ContactsChanged(self, changes, removals):
+        pass
+
+
+class ButterflyContactList(ConnectionInterfaceContactList):
+    """Roster access in a single round trip.
+
+    The subscription states are computed from the papyon address book the
+    same way the subscribe and publish channels filter their members, and
+    the list changes go through the same channels so that both APIs stay
+    consistent."""
+
+    def __init__(self):
+        ConnectionInterfaceContactList.__init__(self)
+        self._contact_list_state = CONTACT_LIST_STATE_NONE
+
+        dbus_interface = CONNECTION_INTERFACE_CONTACT_LIST
+        self._implement_property_get(dbus_interface, {
+            'ContactListState': lambda: dbus.UInt32(self._contact_list_state),
+            'ContactListPersists': lambda: True,
+            'CanChangeContactList': lambda: True,
+            'RequestUsesMessage': lambda: True,
+            'DownloadAtConnection': lambda: True,
+            })
+
+        self._attribute_getters[dbus_interface] = [
+            ('subscribe', lambda handle, contact:
+                dbus.UInt32(self._get_subscription_states(contact)[0])),
+            ('publish', lambda handle, contact:
+                dbus.UInt32(self._get_subscription_states(contact)[1])),
+            ('publish-request', lambda handle, contact:
+                self._get_subscription_states(contact)[2])
+            ]
+
+    # Overwrite the dbus attribute to get the sender argument
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACT_LIST, in_signature='asb',
+            out_signature='a{ua{sv}}', sender_keyword='sender')
+    def GetContactListAttributes(self, interfaces, hold, sender):
+        self.check_connected()
+        if self._contact_list_state != CONTACT_LIST_STATE_SUCCESS:
+            raise telepathy.NotAvailable('Contact list not retrieved yet')
+
+        handles = []
+        for contact in self.msn_client.address_book.contacts:
+            subscribe, publish, request = self._get_subscription_states(contact)
+            if subscribe == SUBSCRIPTION_STATE_NO and \
+                    publish == SUBSCRIPTION_STATE_NO:
+                continue
+            handles.append(self.ensure_contact_handle(contact))
+
+        if hold:
+            self.HoldHandles(telepathy.HANDLE_TYPE_CONTACT,
+                    [handle.get_id() for handle in handles], sender)
+
+        # The ContactList attributes are always returned
+        interfaces = list(interfaces) + [CONNECTION_INTERFACE_CONTACT_LIST]
+        return self._get_contact_attributes(handles, interfaces)
+
+    def RequestSubscription(self, contacts, message):
+        self._get_list_channel('subscribe').AddMembers(contacts, message)
+
+    def AuthorizePublication(self, contacts):
+        self._get_list_channel('publish').AddMembers(contacts, u'')
+
+    def RemoveContacts(self, contacts):
+        self._get_list_channel('subscribe').RemoveMembers(contacts, u'')
+        self._get_list_channel('publish').RemoveMembers(contacts, u'')
+
+    def Unsubscribe(self, contacts):
+        self._get_list_channel('subscribe').RemoveMembers(contacts, u'')
+
+    def Unpublish(self, contacts):
+        self._get_list_channel('publish').RemoveMembers(contacts, u'')
+
+    def Download(self):
+        # The contact list is always downloaded at connection time
+        pass
+
+    def _get_list_channel(self, name):
+        self.check_connected()
+        if self._contact_list_state != CONTACT_LIST_STATE_SUCCESS:
+            raise telepathy.NotAvailable('Contact list not retrieved yet')
+        handle = self.ensure_handle(telepathy.HANDLE_TYPE_LIST, name)
+        props = self._generate_props(telepathy.CHANNEL_TYPE_CONTACT_LIST,
+            handle, False)
+        return self._channel_manager.channel_for_props(props, signal=True)
+
+    def _get_subscription_states(self, contact):
+        """Get the (subscribe, publish, publish-request) of a contact"""
+        if contact is None or contact is self.msn_client.profile:
+            return (SUBSCRIPTION_STATE_NO, SUBSCRIPTION_STATE_NO, None)
+
+        if contact.is_member(papyon.Membership.FORWARD) and \
+                not contact.is_member(papyon.Membership.PENDING):
+            subscribe = SUBSCRIPTION_STATE_YES
+        else:
+            subscribe = SUBSCRIPTION_STATE_NO
+
+        request = None
+        if contact.is_member(papyon.Membership.ALLOW):
+            publish = SUBSCRIPTION_STATE_YES
+        elif contact.is_member(papyon.Membership.PENDING):
+            publish = SUBSCRIPTION_STATE_ASK
+            request = unicode(contact.attributes.get('invite_message', ''),
+                    'utf-8')
+        else:
+            publish = SUBSCRIPTION_STATE_NO
+        return (subscribe, publish, request)
+
+    def _set_contact_list_state(self, state):
+        if state == self._contact_list_state:
+            return
+        self._contact_list_state = state
+        self.ContactListStateChanged(state)
+
+    # Dispatched by ButterflyEventDispatcher
+    def _contact_list_contact_changed(self, handle, contact):
+        if self._contact_list_state != CONTACT_LIST_STATE_SUCCESS:
+            return # the whole list will be fetched anyway
+
+        subscribe, publish, request = self._get_subscription_states(contact)
+        if subscribe == SUBSCRIPTION_STATE_NO and \
+                publish == SUBSCRIPTION_STATE_NO:
+            self.ContactsChanged(
+                    dbus.Dictionary({}, signature='u(uus)'), [handle])
+        else:
+            changes = {handle: (subscribe, publish, request or u'')}
+            self.ContactsChanged(
+                    dbus.Dictionary(changes, signature='u(uus)'), [])
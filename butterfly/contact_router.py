@@ -0,0 +1,71 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+import weakref
+
+__all__ = ['ButterflyContactEventRouter']
+
+logger = logging.getLogger('Butterfly.ContactEventRouter')
+
+
+class ButterflyContactEventRouter(object):
+    """Deliver papyon contact events to the objects tracking the contact.
+
+    Channels used to register as papyon.event.ContactEventInterface on the
+    whole client and then check whether each event was about their own
+    contact. Instead, the connection hands the contact events to the
+    router, which only calls the subscribers of that contact, plus the
+    few subscribers interested in every contact.
+
+    Subscribers are held weakly and get the events through methods named
+    after them (on_contact_presence_changed, ...), as with papyon."""
+
+    def __init__(self):
+        self._subscribers = weakref.WeakKeyDictionary()
+        self._wildcard_subscribers = weakref.WeakSet()
+
+    def subscribe(self, contact, subscriber):
+        """Receive the events of a given contact."""
+        subscribers = self._subscribers.get(contact, None)
+        if subscribers is None:
+            subscribers = weakref.WeakSet()
+            self._subscribers[contact] = subscribers
+        subscribers.add(subscriber)
+
+    def unsubscribe(self, contact, subscriber):
+        subscribers = self._subscribers.get(contact, None)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[contact]
+
+    def subscribe_all(self, subscriber):
+        """Receive the events of every contact."""
+        self._wildcard_subscribers.add(subscriber)
+
+    def route(self, event_name, contact, *args):
+        # Copy the subscribers, handlers may unsubscribe
+        subscribers = list(self._wildcard_subscribers)
+        contact_subscribers = self._subscribers.get(contact, None)
+        if contact_subscribers is not None:
+            subscribers.extend(contact_subscribers)
+
+        for subscriber in subscribers:
+            handler = getattr(subscriber, event_name, None)
+            if handler is not None:
+                handler(contact, *args)
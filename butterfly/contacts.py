@@ -22,7 +22,6 @@ import time
 
 import telepathy
 import telepathy.errors
-import papyon
 import dbus
 
 __all__ = ['ButterflyContacts']
@@ -30,75 +29,82 @@ __all__ = ['ButterflyContacts']
 logger = logging.getLogger('Butterfly.Contacts')
 
 class ButterflyContacts(
-        telepathy.server.ConnectionInterfaceContacts,
-        papyon.event.ContactEventInterface,
-        papyon.event.ProfileEventInterface):
-
-    attributes = {
-        telepathy.CONNECTION : 'contact-id',
-        telepathy.CONNECTION_INTERFACE_SIMPLE_PRESENCE : 'presence',
-        telepathy.CONNECTION_INTERFACE_ALIASING : 'alias',
-        telepathy.CONNECTION_INTERFACE_AVATARS : 'token',
-        telepathy.CONNECTION_INTERFACE_CAPABILITIES : 'caps',
-        telepathy.CONNECTION_INTERFACE_CONTACT_CAPABILITIES : 'capabilities'
-        }
+        telepathy.server.ConnectionInterfaceContacts):
 
     def __init__(self):
         telepathy.server.ConnectionInterfaceContacts.__init__(self)
-        papyon.event.ContactEventInterface.__init__(self, self.msn_client)
-        papyon.event.ProfileEventInterface.__init__(self, self.msn_client)
 
         dbus_interface = telepathy.CONNECTION_INTERFACE_CONTACTS
 
         self._implement_property_get(dbus_interface, \
                 {'ContactAttributeInterfaces' : self.get_contact_attribute_interfaces})
 
+        # Each interface maps to a list of (attribute, getter). A getter takes
+        # a handle and its papyon contact and returns the attribute value, or
+        # None if the attribute should be omitted.
+        self._attribute_getters = {
+            telepathy.CONNECTION : [
+                ('contact-id', lambda handle, contact: handle.get_name())],
+            telepathy.CONNECTION_INTERFACE_SIMPLE_PRESENCE : [
+                ('presence', lambda handle, contact:
+                    self._get_simple_presence(contact))],
+            telepathy.CONNECTION_INTERFACE_ALIASING : [
+                ('alias', self._get_handle_alias)],
+            telepathy.CONNECTION_INTERFACE_AVATARS : [
+                ('token', lambda handle, contact:
+                    self._get_avatar_token(contact))],
+            telepathy.CONNECTION_INTERFACE_CAPABILITIES : [
+                ('caps', lambda handle, contact:
+                    self._get_handle_capabilities(handle))],
+            telepathy.CONNECTION_INTERFACE_CONTACT_CAPABILITIES : [
+                ('capabilities', lambda handle, contact:
+                    self._get_handle_contact_capabilities(handle))]
+            }
+
     # Overwrite the dbus attribute to get the sender argument
     @dbus.service.method(telepathy.CONNECTION_INTERFACE_CONTACTS, in_signature='auasb',
                             out_signature='a{ua{sv}}', sender_keyword='sender')
     def GetContactAttributes(self, handles, interfaces, hold, sender):
-        #InspectHandle already checks we're connected, the handles and handle type.
-        supported_interfaces = set()
-        for interface in interfaces:
-            if interface in self.attributes:
-                supported_interfaces.add(interface)
-            else:
-                logger.debug("Ignoring unsupported interface %s" % interface)
+        self.check_connected()
 
+        # Resolve every handle once, this also checks they are valid
         handle_type = telepathy.HANDLE_TYPE_CONTACT
-        ret = dbus.Dictionary(signature='ua{sv}')
-        for handle in handles:
-            ret[handle] = dbus.Dictionary(signature='sv')
-
-        functions = {
-            telepathy.CONNECTION :
-                lambda x: zip(x, self.InspectHandles(handle_type, x)),
-            telepathy.CONNECTION_INTERFACE_SIMPLE_PRESENCE :
-                lambda x: self.GetPresences(x).items(),
-            telepathy.CONNECTION_INTERFACE_ALIASING :
-                lambda x: self.GetAliases(x).items(),
-            telepathy.CONNECTION_INTERFACE_AVATARS :
-                lambda x: self.GetKnownAvatarTokens(x).items(),
-            telepathy.CONNECTION_INTERFACE_CAPABILITIES :
-                lambda x: self.GetCapabilities(x).items(),
-            telepathy.CONNECTION_INTERFACE_CONTACT_CAPABILITIES :
-                lambda x: self.GetContactCapabilities(x).items()
-            }
+        resolved = [self.handle(handle_type, handle_id) for handle_id in handles]
 
         #Hold handles if needed
         if hold:
             self.HoldHandles(handle_type, handles, sender)
 
+        return self._get_contact_attributes(resolved, interfaces)
+
+    def _get_contact_attributes(self, handles, interfaces):
+        """Build the a{ua{sv}} attributes of already resolved handles."""
+        supported_interfaces = set()
+        for interface in interfaces:
+            if interface in self._attribute_getters:
+                supported_interfaces.add(interface)
+            else:
+                logger.debug("Ignoring unsupported interface %s" % interface)
+
         # Attributes from the interface org.freedesktop.Telepathy.Connection
         # are always returned, and need not be requested explicitly.
         supported_interfaces.add(telepathy.CONNECTION)
 
+        getters = []
         for interface in supported_interfaces:
-            interface_attribute = interface + '/' + self.attributes[interface]
-            results = functions[interface](handles)
-            for handle, value in results:
-                ret[int(handle)][interface_attribute] = value
+            for attribute, getter in self._attribute_getters[interface]:
+                getters.append((interface + '/' + attribute, getter))
+
+        ret = dbus.Dictionary(signature='ua{sv}')
+        for handle in handles:
+            contact = handle.contact
+            attributes = dbus.Dictionary(signature='sv')
+            for interface_attribute, getter in getters:
+                value = getter(handle, contact)
+                if value is not None:
+                    attributes[interface_attribute] = value
+            ret[int(handle)] = attributes
         return ret
 
     def get_contact_attribute_interfaces(self):
-        return self.attributes.keys()
+        return self._attribute_getters.keys()
@@ -0,0 +1,195 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+import weakref
+
+import papyon
+import papyon.event
+
+__all__ = ['ButterflyEventDispatcher']
+
+logger = logging.getLogger('Butterfly.EventDispatcher')
+
+
+class ButterflyEventDispatcher(
+        papyon.event.ContactEventInterface,
+        papyon.event.ProfileEventInterface,
+        papyon.event.AddressBookEventInterface):
+    """Single receiver of the papyon contact, profile and address book
+    events of a connection.
+
+    The connection interfaces used to register on the client one by one
+    and to each resolve the contact handle of every event. The dispatcher
+    gets each event once, resolves the handle once, and then calls the
+    handlers of the address book index, of the connection interfaces, and
+    of the channels through the contact event router, in that order.
+
+    The number of events received is counted by event type, see
+    event_counts."""
+
+    def __init__(self, connection, client):
+        self._conn_ref = weakref.ref(connection)
+        self._event_counts = {}
+        papyon.event.ContactEventInterface.__init__(self, client)
+        papyon.event.ProfileEventInterface.__init__(self, client)
+        papyon.event.AddressBookEventInterface.__init__(self, client)
+
+    @property
+    def event_counts(self):
+        """Number of events received, by event name"""
+        return dict(self._event_counts)
+
+    def log_event_counts(self):
+        counts = sorted(self._event_counts.items(),
+                key=lambda item: item[1], reverse=True)
+        logger.debug("Events received: %d" % sum(self._event_counts.values()))
+        for name, count in counts:
+            logger.debug("%s: %d" % (name, count))
+
+    def _count(self, name):
+        self._event_counts[name] = self._event_counts.get(name, 0) + 1
+
+    def _contact_event(self, name, contact):
+        self._count(name)
+        conn = self._conn_ref()
+        return conn, conn.ensure_contact_handle(contact)
+
+    # papyon.event.ContactEventInterface
+    def on_contact_presence_changed(self, contact):
+        conn, handle = self._contact_event('contact_presence_changed', contact)
+        conn._contact_presence_changed(handle, contact)
+        conn.contact_event_router.route('on_contact_presence_changed',
+                contact)
+
+    # papyon.event.ContactEventInterface
+    def on_contact_personal_message_changed(self, contact):
+        conn, handle = self._contact_event('contact_personal_message_changed',
+                contact)
+        conn._contact_presence_changed(handle, contact)
+
+    # papyon.event.ContactEventInterface
+    def on_contact_display_name_changed(self, contact):
+        conn, handle = self._contact_event('contact_display_name_changed',
+                contact)
+        conn._contact_alias_changed(handle, contact)
+
+    # papyon.event.ContactEventInterface
+    def on_contact_infos_changed(self, contact, updated_infos):
+        conn, handle = self._contact_event('contact_infos_changed', contact)
+        conn._contact_infos_changed(handle, contact, updated_infos)
+
+    # papyon.event.ContactEventInterface
+    def on_contact_memberships_changed(self, contact):
+        conn, handle = self._contact_event('contact_memberships_changed',
+                contact)
+        conn._flush_pending_alias(handle, contact)
+        conn._contact_list_contact_changed(handle, contact)
+        conn.contact_event_router.route('on_contact_memberships_changed',
+                contact)
+
+    # papyon.event.ContactEventInterface
+    def on_contact_msn_object_changed(self, contact):
+        conn, handle = self._contact_event('contact_msn_object_changed',
+                contact)
+        conn._contact_avatar_changed(handle, contact)
+
+    # papyon.event.ContactEventInterface
+    def on_contact_client_capabilities_changed(self, contact):
+        conn, handle = self._contact_event(
+                'contact_client_capabilities_changed', contact)
+        conn._contact_capabilities_changed(handle, contact)
+
+    # papyon.event.ProfileEventInterface
+    def on_profile_presence_changed(self):
+        self._count('profile_presence_changed')
+        self._conn_ref()._profile_presence_changed()
+
+    # papyon.event.ProfileEventInterface
+    def on_profile_personal_message_changed(self):
+        self._count('profile_personal_message_changed')
+        self._conn_ref()._profile_presence_changed()
+
+    # papyon.event.ProfileEventInterface
+    def on_profile_display_name_changed(self):
+        self._count('profile_display_name_changed')
+        conn = self._conn_ref()
+        conn._contact_alias_changed(conn._self_handle,
+                conn.msn_client.profile)
+
+    # papyon.event.ProfileEventInterface
+    def on_profile_msn_object_changed(self):
+        self._count('profile_msn_object_changed')
+        self._conn_ref()._profile_avatar_changed()
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_contact_added(self, contact):
+        self._count('addressbook_contact_added')
+        conn = self._conn_ref()
+        conn.address_book_index.on_addressbook_contact_added(contact)
+        handle = conn.ensure_contact_handle(contact)
+        conn._contact_added_capabilities(handle, contact)
+        conn._contact_list_contact_changed(handle, contact)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_contact_deleted(self, contact):
+        self._count('addressbook_contact_deleted')
+        conn = self._conn_ref()
+        # Resolved first, resolving an unknown contact adds it to the index
+        handle = conn.ensure_contact_handle(contact)
+        conn.address_book_index.on_addressbook_contact_deleted(contact)
+        conn._contact_list_contact_changed(handle, contact)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_added(self, group):
+        self._count('addressbook_group_added')
+        conn = self._conn_ref()
+        conn.address_book_index.on_addressbook_group_added(group)
+        conn._group_added(group)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_deleted(self, group):
+        self._count('addressbook_group_deleted')
+        conn = self._conn_ref()
+        conn.address_book_index.on_addressbook_group_deleted(group)
+        conn._group_deleted(group)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_renamed(self, group):
+        self._count('addressbook_group_renamed')
+        conn = self._conn_ref()
+        index = conn.address_book_index
+        old_name = index.get_group_name(group)
+        index.on_addressbook_group_renamed(group)
+        conn._group_renamed(group, old_name)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_contact_added(self, group, contact):
+        self._count('addressbook_group_contact_added')
+        conn = self._conn_ref()
+        conn.address_book_index.on_addressbook_group_contact_added(group,
+                contact)
+        handle = conn.ensure_contact_handle(contact)
+        conn._group_contact_added(group, handle)
+
+    # papyon.event.AddressBookEventInterface
+    def on_addressbook_group_contact_deleted(self, group, contact):
+        self._count('addressbook_group_contact_deleted')
+        conn = self._conn_ref()
+        conn.address_book_index.on_addressbook_group_contact_deleted(group,
+                contact)
+        handle = conn.ensure_contact_handle(contact)
+        conn._group_contact_deleted(group, handle)
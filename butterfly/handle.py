@@ -84,7 +84,7 @@ class ButterflyContactHandle(ButterflyHandle):
                     self.network == papyon.NetworkID.MSN:
                 self._contact = self._conn.msn_client.profile
             else:
-                self._contact = self._conn.msn_client.address_book.search_contact(
+                self._contact = self._conn.address_book_index.search_contact(
                         self.account, self.network)
         return self._contact
 
@@ -104,8 +104,5 @@ class ButterflyGroupHandle(ButterflyHandle):
 
     @property
     def group(self):
-        for group in self._conn.msn_client.address_book.groups:
-            # Microsoft seems to like case insensitive stuff
-            if group.name.decode("utf-8").lower() == self.name.lower():
-                return group
-        return None
+        # Microsoft seems to like case insensitive stuff
+        return self._conn.address_book_index.search_group(self.name)
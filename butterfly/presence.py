@@ -28,12 +28,16 @@ import telepathy.constants
 import telepathy.errors
 import papyon
 
-from butterfly.util.decorator import async
+from butterfly.util.idle import IdleBatcher
 
 __all__ = ['ButterflyPresence']
 
 logger = logging.getLogger('Butterfly.Presence')
 
+# Delay (in milliseconds) during which presence changes are collected before
+# being signalled, 0 means they are signalled at the next mainloop iteration.
+PRESENCE_BATCH_DELAY = 0
+
 
 class ButterflyPresenceMapping(object):
     ONLINE = 'available'
@@ -83,15 +87,14 @@ class ButterflyPresenceMapping(object):
             }
 
 class ButterflyPresence(telepathy.server.ConnectionInterfacePresence,
-        telepathy.server.ConnectionInterfaceSimplePresence,
-        papyon.event.ContactEventInterface,
-        papyon.event.ProfileEventInterface):
+        telepathy.server.ConnectionInterfaceSimplePresence):
 
     def __init__(self):
         telepathy.server.ConnectionInterfacePresence.__init__(self)
         telepathy.server.ConnectionInterfaceSimplePresence.__init__(self)
-        papyon.event.ContactEventInterface.__init__(self, self.msn_client)
-        papyon.event.ProfileEventInterface.__init__(self, self.msn_client)
+
+        self._presence_batcher = IdleBatcher(self._emit_presences_changed,
+                PRESENCE_BATCH_DELAY)
 
         self._implement_property_get(
             telepathy.CONNECTION_INTERFACE_SIMPLE_PRESENCE, {
@@ -153,14 +156,14 @@ class ButterflyPresence(telepathy.server.ConnectionInterfacePresence,
         logger.info("Setting Presence to '%s'" % presence)
         logger.info("Setting Personal message to '%s'" % message)
 
-        message.encode("utf-8")
+        message = message.encode("utf-8")
 
         if self._status != telepathy.CONNECTION_STATUS_CONNECTED:
             self._initial_presence = presence
             self._initial_personal_message = message
         else:
-            self.msn_client.profile.personal_message = message
-            self.msn_client.profile.presence = presence
+            self._profile_updater.set('personal_message', message)
+            self._profile_updater.set('presence', presence)
 
     def get_presences(self, contacts):
         presences = {}
@@ -206,57 +209,60 @@ class ButterflyPresence(telepathy.server.ConnectionInterfacePresence,
             self._initial_presence = presence
             self._initial_personal_message = message
         else:
-            self.msn_client.profile.personal_message = message
-            self.msn_client.profile.presence = presence
+            self._profile_updater.set('personal_message', message)
+            self._profile_updater.set('presence', presence)
 
     def get_simple_presences(self, contacts):
         presences = dbus.Dictionary(signature='u(uss)')
         for handle_id in contacts:
             handle = self.handle(telepathy.HANDLE_TYPE_CONTACT, handle_id)
-            contact = handle.contact
+            presences[handle] = self._get_simple_presence(handle.contact)
+        return presences
 
-            if contact is not None:
-                presence = ButterflyPresenceMapping.to_telepathy[contact.presence]
-                personal_message = unicode(contact.personal_message, "utf-8")
-            else:
-                presence = ButterflyPresenceMapping.OFFLINE
-                personal_message = u""
+    def _get_simple_presence(self, contact):
+        if contact is not None:
+            presence = ButterflyPresenceMapping.to_telepathy[contact.presence]
+            personal_message = unicode(contact.personal_message, "utf-8")
+        else:
+            presence = ButterflyPresenceMapping.OFFLINE
+            personal_message = u""
 
-            presence_type = ButterflyPresenceMapping.to_presence_type[presence]
+        presence_type = ButterflyPresenceMapping.to_presence_type[presence]
 
-            presences[handle] = dbus.Struct((presence_type, presence,
-                personal_message), signature='uss')
-        return presences
+        return dbus.Struct((presence_type, presence, personal_message),
+                signature='uss')
 
-    # papyon.event.ContactEventInterface
-    def on_contact_presence_changed(self, contact):
-        handle = self.ensure_contact_handle(contact)
+    # Dispatched by ButterflyEventDispatcher
+    def _contact_presence_changed(self, handle, contact):
         logger.info("Contact %s presence changed to '%s'" % (unicode(handle),
             contact.presence))
         self._presence_changed(handle, contact.presence, contact.personal_message)
 
-    # papyon.event.ContactEventInterface
-    on_contact_personal_message_changed = on_contact_presence_changed
-
-    # papyon.event.ProfileEventInterface
-    def on_profile_presence_changed(self):
+    # Dispatched by ButterflyEventDispatcher
+    def _profile_presence_changed(self):
         profile = self.msn_client.profile
         self._presence_changed(self._self_handle,
                 profile.presence, profile.personal_message)
 
-    # papyon.event.ProfileEventInterface
-    on_profile_personal_message_changed = on_profile_presence_changed
-
-    @async
     def _presence_changed(self, handle, presence, personal_message):
-        presence = ButterflyPresenceMapping.to_telepathy[presence]
-        presence_type = ButterflyPresenceMapping.to_presence_type[presence]
-        personal_message = unicode(personal_message, "utf-8")
+        # Only the latest state of each handle is kept until the next flush
+        self._presence_batcher.add(handle, (presence, personal_message))
+
+    def _emit_presences_changed(self, changes):
+        timestamp = int(time.time())
+        simple_presences = {}
+        presences = {}
+        for handle, (presence, personal_message) in changes:
+            presence = ButterflyPresenceMapping.to_telepathy[presence]
+            presence_type = ButterflyPresenceMapping.to_presence_type[presence]
+            personal_message = unicode(personal_message, "utf-8")
 
-        self.PresencesChanged({handle: (presence_type, presence, personal_message)})
+            simple_presences[handle] = (presence_type, presence, personal_message)
 
-        arguments = {}
-        if personal_message:
-            arguments = {'message' : personal_message}
+            arguments = {}
+            if personal_message:
+                arguments = {'message' : personal_message}
+            presences[handle] = (timestamp, {presence : arguments})
 
-        self.PresenceUpdate({handle: (int(time.time()), {presence:arguments})})
+        self.PresencesChanged(simple_presences)
+        self.PresenceUpdate(presences)
@@ -0,0 +1,75 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+import weakref
+
+from butterfly.util.idle import IdleBatcher
+
+__all__ = ['ButterflyProfileUpdater']
+
+logger = logging.getLogger('Butterfly.ProfileUpdater')
+
+# Delay (in milliseconds) during which changes to our own profile are
+# collected before being sent to the server
+PROFILE_UPDATE_DELAY = 250
+
+
+class ButterflyProfileUpdater(object):
+    """Combine the changes made to our own papyon profile.
+
+    Each assignment of a profile attribute (presence, personal_message,
+    display_name) makes papyon send a command to the notification server.
+    The updater keeps the latest value of each attribute for a short
+    while and then only assigns those which differ from the profile, so a
+    burst of changes costs at most one command per attribute, and setting
+    a value the profile already has costs nothing.
+
+    The values are assigned in the order the attributes were first set."""
+
+    def __init__(self, connection, delay=PROFILE_UPDATE_DELAY):
+        self._conn_ref = weakref.ref(connection)
+        self._batcher = IdleBatcher(self._apply, delay)
+
+    def set(self, attribute, value):
+        if attribute not in self._batcher and \
+                getattr(self._profile, attribute) == value:
+            return
+        self._batcher.add(attribute, value)
+
+    def get(self, attribute):
+        """Get the value an attribute of the profile is going to have."""
+        if attribute in self._batcher:
+            return self._batcher.get(attribute)
+        return getattr(self._profile, attribute)
+
+    def cancel(self):
+        self._batcher.cancel()
+
+    @property
+    def _profile(self):
+        return self._conn_ref().msn_client.profile
+
+    def _apply(self, changes):
+        conn = self._conn_ref()
+        if conn is None:
+            return
+        profile = conn.msn_client.profile
+        for attribute, value in changes:
+            if getattr(profile, attribute) == value:
+                continue # set back to its current value
+            logger.debug("Setting profile %s to %r" % (attribute, value))
+            setattr(profile, attribute, value)
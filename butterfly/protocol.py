@@ -25,6 +25,9 @@ import papyon.event
 
 from butterfly.connection import ButterflyConnection
 from butterfly.presence import ButterflyPresenceMapping
+from butterfly.contact_list import CONNECTION_INTERFACE_CONTACT_LIST
+from butterfly.contact_groups import CONNECTION_INTERFACE_CONTACT_GROUPS
+from butterfly.avatar_files import CONNECTION_INTERFACE_AVATAR_FILES
 
 __all__ = ['ButterflyProtocol']
 
@@ -59,11 +62,19 @@ class ButterflyProtocol(telepathy.server.Protocol,
             'https-proxy-username' : 's',
             'https-proxy-password' : 's',
             'http-method' : 'b',
+            'avatar-fetch-limit' : 'u',
+            'avatar-prefetch' : 'b',
+            'avatar-normalize' : 'b',
+            'capabilities-slice-size' : 'u',
             }
     _parameter_defaults = {
             'server' : u'messenger.hotmail.com',
             'port' : 1863,
-            'http-method' : False
+            'http-method' : False,
+            'avatar-fetch-limit' : 3,
+            'avatar-prefetch' : False,
+            'avatar-normalize' : False,
+            'capabilities-slice-size' : 100
             }
 
     _requestable_channel_classes = [
@@ -112,11 +123,14 @@ class ButterflyProtocol(telepathy.server.Protocol,
     _supported_interfaces = [
             telepathy.CONNECTION_INTERFACE_ALIASING,
             telepathy.CONNECTION_INTERFACE_AVATARS,
+            CONNECTION_INTERFACE_AVATAR_FILES,
             telepathy.CONNECTION_INTERFACE_CAPABILITIES,
             telepathy.CONNECTION_INTERFACE_CONTACT_CAPABILITIES,
             telepathy.CONNECTION_INTERFACE_PRESENCE,
             telepathy.CONNECTION_INTERFACE_SIMPLE_PRESENCE,
             telepathy.CONNECTION_INTERFACE_CONTACTS,
+            CONNECTION_INTERFACE_CONTACT_LIST,
+            CONNECTION_INTERFACE_CONTACT_GROUPS,
             telepathy.CONNECTION_INTERFACE_REQUESTS,
             telepathy.CONNECTION_INTERFACE_MAIL_NOTIFICATION
         ]
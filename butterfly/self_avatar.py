@@ -0,0 +1,116 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+
+__all__ = ['ButterflySelfAvatarStore']
+
+logger = logging.getLogger('Butterfly.SelfAvatarStore')
+
+
+def _default_store_dir():
+    data_home = os.environ.get('XDG_DATA_HOME', None)
+    if not data_home:
+        data_home = os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(data_home, 'telepathy', 'butterfly', 'avatars')
+
+
+class ButterflySelfAvatarStore(object):
+    """Our own avatar, stored on disk per account.
+
+    The avatar data is kept in a file named after the hex SHA1 of the
+    lowercase account, as accounts may hold any character, and the hex
+    SHA1 of the avatar next to it with a `.sha` suffix, so that the
+    MSNObject can be rebuilt at login without hashing the image again. The
+    data is memory mapped rather than read, the mapping is what papyon
+    serves to the peers.
+
+    Unlike the avatar cache, nothing is ever evicted from here. The store
+    is written from the avatar worker thread and read from the mainloop,
+    never both at once for the same connection."""
+
+    def __init__(self, account, path=None):
+        if path is None:
+            path = _default_store_dir()
+        self._path = path
+        self._name = hashlib.sha1(account.lower().encode('utf-8')).hexdigest()
+
+    def load(self):
+        """Get the (token, data) of the stored avatar, with the data as a
+        read only mmap, or None if there is no usable avatar stored."""
+        data_path = os.path.join(self._path, self._name)
+        try:
+            f = open(data_path + '.sha', 'r')
+            try:
+                token = f.read().strip()
+            finally:
+                f.close()
+            if len(token) != 40:
+                raise ValueError("Invalid avatar token %r" % token)
+            return (token, self._map(data_path))
+        except (IOError, OSError, ValueError), e:
+            if getattr(e, 'errno', None) != errno.ENOENT:
+                logger.warning("Failed to load self avatar: %s" % e)
+            return None
+
+    def save(self, token, data):
+        """Store the avatar and return its data as a read only mmap."""
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path, 0700)
+        data_path = os.path.join(self._path, self._name)
+        # Without its .sha file the data is ignored, so an interrupted save
+        # can't pair the new data with the old token
+        self._unlink(data_path + '.sha')
+        self._write(data_path, data)
+        self._write(data_path + '.sha', token + '\n')
+        return self._map(data_path)
+
+    def clear(self):
+        data_path = os.path.join(self._path, self._name)
+        self._unlink(data_path + '.sha')
+        self._unlink(data_path)
+
+    def _map(self, path):
+        f = open(path, 'rb')
+        try:
+            # mmap raises a ValueError for empty files
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(prefix='.', dir=self._path)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
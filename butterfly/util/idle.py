@@ -0,0 +1,124 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Mainloop helpers"""
+
+import time
+
+import gobject
+
+__all__ = ['IdleBatcher', 'IdleSlicer']
+
+
+class IdleBatcher(object):
+    """Collect values by key and hand them all at once to a flush callback.
+
+    Only the latest value queued for a given key is kept. The flush happens
+    at the next mainloop idle state, or after `delay` milliseconds if a delay
+    is given, so that bursts of changes end up in a single call."""
+
+    def __init__(self, flush_cb, delay=0):
+        self._flush_cb = flush_cb
+        self._delay = delay
+        self._pending = {}
+        self._order = []
+        self._source = 0
+
+    def __contains__(self, key):
+        return key in self._pending
+
+    def get(self, key, default=None):
+        return self._pending.get(key, default)
+
+    def add(self, key, value):
+        if key not in self._pending:
+            self._order.append(key)
+        self._pending[key] = value
+        if self._source == 0:
+            if self._delay > 0:
+                self._source = gobject.timeout_add(self._delay, self._timeout)
+            else:
+                self._source = gobject.idle_add(self._timeout)
+
+    def flush(self):
+        """Flush the queued values right away."""
+        if self._source != 0:
+            gobject.source_remove(self._source)
+            self._source = 0
+        if not self._pending:
+            return
+        pending = self._pending
+        items = [(key, pending[key]) for key in self._order]
+        self._pending = {}
+        self._order = []
+        self._flush_cb(items)
+
+    def cancel(self):
+        """Drop the queued values without flushing them."""
+        if self._source != 0:
+            gobject.source_remove(self._source)
+            self._source = 0
+        self._pending = {}
+        self._order = []
+
+    def _timeout(self):
+        self._source = 0
+        self.flush()
+        return False
+
+
+class IdleSlicer(object):
+    """Feed the items of an iterable to a callback, a slice at a time.
+
+    Each slice of `slice_size` items is processed from its own mainloop
+    idle callback, so that walking a very large collection doesn't block
+    the mainloop. If a `time_budget` (in seconds) is given, a slice also
+    ends once it has run for that long. `done_cb` is called once the
+    iterable is exhausted."""
+
+    def __init__(self, iterable, step_cb, done_cb, slice_size=100,
+            time_budget=None):
+        self._iterator = iter(iterable)
+        self._step_cb = step_cb
+        self._done_cb = done_cb
+        self._slice_size = max(1, slice_size)
+        self._time_budget = time_budget
+        self._source = 0
+
+    def start(self):
+        if self._source == 0:
+            self._source = gobject.idle_add(self._process)
+
+    def cancel(self):
+        """Stop walking the iterable, without calling `done_cb`."""
+        if self._source != 0:
+            gobject.source_remove(self._source)
+            self._source = 0
+
+    def _process(self):
+        if self._time_budget is not None:
+            deadline = time.time() + self._time_budget
+        for i in xrange(self._slice_size):
+            try:
+                item = self._iterator.next()
+            except StopIteration:
+                self._source = 0
+                self._done_cb()
+                return False
+            self._step_cb(item)
+            if self._time_budget is not None and time.time() >= deadline:
+                break
+        return True
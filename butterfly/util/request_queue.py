@@ -0,0 +1,70 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Bounded queue of asynchronous requests"""
+
+from collections import deque
+
+__all__ = ['RequestQueue']
+
+
+class RequestQueue(object):
+    """Run asynchronous requests with a bound on how many are in flight.
+
+    A request is a callable accepting the papyon style `done_cb` and
+    `failed_cb` keyword arguments, as the address book methods do. Requests
+    are queued by key: pushing a request for a key which is still waiting
+    replaces the waiting request, and the callbacks given for both are
+    called once it completes, with the arguments papyon gave."""
+
+    def __init__(self, max_in_flight):
+        self._max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._order = deque()
+        self._waiting = {}
+
+    def push(self, key, request, done_cb=None, failed_cb=None):
+        entry = self._waiting.get(key, None)
+        if entry is None:
+            entry = [request, []]
+            self._waiting[key] = entry
+            self._order.append(key)
+        else:
+            entry[0] = request
+        entry[1].append((done_cb, failed_cb))
+        self._process()
+
+    def cancel(self):
+        """Drop the waiting requests, the ones in flight still complete."""
+        self._order.clear()
+        self._waiting = {}
+
+    def _process(self):
+        while self._order and self._in_flight < self._max_in_flight:
+            request, callbacks = self._waiting.pop(self._order.popleft())
+            self._in_flight += 1
+            request(done_cb=(self._request_done, callbacks, 0),
+                    failed_cb=(self._request_done, callbacks, 1))
+
+    def _request_done(self, *args):
+        # papyon puts the callback data after the results
+        results, callbacks, index = args[:-2], args[-2], args[-1]
+        self._in_flight -= 1
+        for callback_pair in callbacks:
+            callback = callback_pair[index]
+            if callback is not None:
+                callback(*results)
+        self._process()
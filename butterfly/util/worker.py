@@ -0,0 +1,62 @@
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Background thread helper"""
+
+import threading
+import Queue
+
+import gobject
+
+__all__ = ['ThreadWorker']
+
+
+class ThreadWorker(object):
+    """Run functions one at a time in a background thread.
+
+    The result of each function is handed to its callback, or the exception
+    it raised to its errback, from the mainloop. The functions must not
+    touch anything the mainloop uses at the same time.
+
+    gobject.threads_init() must have been called before the mainloop was
+    created, otherwise the thread only runs when the mainloop wakes up."""
+
+    def __init__(self, name):
+        self._name = name
+        self._jobs = Queue.Queue()
+        self._thread = None
+
+    def run(self, func, args, callback, errback):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop,
+                    name=self._name)
+            self._thread.setDaemon(True)
+            self._thread.start()
+        self._jobs.put((func, args, callback, errback))
+
+    def _loop(self):
+        while True:
+            func, args, callback, errback = self._jobs.get()
+            try:
+                result = func(*args)
+            except Exception, e:
+                gobject.idle_add(self._deliver, errback, e)
+            else:
+                gobject.idle_add(self._deliver, callback, result)
+
+    def _deliver(self, callback, value):
+        callback(value)
+        return False
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+#
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Measure the CPU time per MB spent handling avatar data in SetAvatar
+and when emitting AvatarRetrieved, before and after the avatar data
+stopped being copied byte per byte.
+
+Only needs dbus-python.
+
+Usage: tools/benchmark-avatar-data.py [avatar size in KB ...]"""
+
+import imghdr
+import os
+import sys
+import time
+
+import dbus
+
+# Same as in butterfly.avatars, copied so that only dbus-python is needed
+IMAGE_HEADER_SIZE = 32
+
+# Amount of avatar data handled for each measure
+TOTAL_SIZE = 16 * 1024 * 1024
+
+
+def set_avatar_bytes(avatar):
+    """SetAvatar without byte_arrays, getting a sequence of dbus.Byte"""
+    return "".join([chr(b) for b in avatar])
+
+def set_avatar_bytearray(avatar):
+    """SetAvatar given a sequence of bytes by another caller"""
+    return str(bytearray(avatar))
+
+def set_avatar_str(avatar):
+    """SetAvatar with byte_arrays, getting a str"""
+    if not isinstance(avatar, str):
+        avatar = str(bytearray(avatar))
+    return avatar
+
+def retrieved_copy(avatar):
+    imghdr.what('', avatar)
+    return dbus.ByteArray(avatar)
+
+def retrieved_header(avatar):
+    imghdr.what('', avatar[:IMAGE_HEADER_SIZE])
+    return avatar
+
+
+def cpu_time_per_mb(func, data):
+    rounds = max(1, TOTAL_SIZE // len(data))
+    start = time.clock()
+    for i in xrange(rounds):
+        func(data)
+    return (time.clock() - start) * 1e3 / (rounds * len(data) / 1048576.0)
+
+
+def run(size):
+    avatar = os.urandom(size * 1024)
+    avatar_bytes = [dbus.Byte(ord(c)) for c in avatar]
+
+    print "%4d KB avatars, CPU ms per MB:" % size
+    print "  SetAvatar, dbus.Byte join  %8.2f" % \
+            cpu_time_per_mb(set_avatar_bytes, avatar_bytes)
+    print "  SetAvatar, bytearray       %8.2f" % \
+            cpu_time_per_mb(set_avatar_bytearray, avatar_bytes)
+    print "  SetAvatar, byte_arrays str %8.2f" % \
+            cpu_time_per_mb(set_avatar_str, avatar)
+    print "  AvatarRetrieved, copy      %8.2f" % \
+            cpu_time_per_mb(retrieved_copy, avatar)
+    print "  AvatarRetrieved, no copy   %8.2f" % \
+            cpu_time_per_mb(retrieved_header, avatar)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [16, 96, 500]
+    for size in sizes:
+        run(size)
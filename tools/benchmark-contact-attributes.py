@@ -0,0 +1,175 @@
+#!/usr/bin/python
+#
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Time the single pass building of GetContactAttributes results against
+one pass per interface, which is how they used to be built.
+
+Needs telepathy-python and papyon to be importable, but no connection:
+the attributes are built by a stand-in object borrowing the connection
+methods, over stub contacts.
+
+Usage: tools/benchmark-contact-attributes.py [handle count ...]"""
+
+import os
+import sys
+import time
+import weakref
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import telepathy
+import papyon
+
+from butterfly.connection import ButterflyConnection
+from butterfly.capabilities import ButterflyCapabilities
+
+# Times each result is built for each handle count
+ROUNDS = 5
+
+
+class StubClientCapabilities(object):
+    supports_sip_invite = True
+    has_webcam = False
+
+
+class StubContact(object):
+    def __init__(self, account):
+        self.account = account
+        self.network_id = papyon.NetworkID.MSN
+        self.presence = papyon.Presence.ONLINE
+        self.personal_message = "Benchmarking"
+        self.display_name = account.split('@', 1)[0]
+        self.infos = {}
+        self.msn_object = None
+        self.client_capabilities = StubClientCapabilities()
+
+
+class StubConnection(object):
+    """The parts of ButterflyConnection used to build contact attributes."""
+
+    handle = ButterflyConnection.handle.im_func
+    create_handle = ButterflyConnection.create_handle.im_func
+    _get_contact_attributes = ButterflyConnection._get_contact_attributes.im_func
+    _get_simple_presence = ButterflyConnection._get_simple_presence.im_func
+    _get_handle_alias = ButterflyConnection._get_handle_alias.im_func
+    _compute_alias = ButterflyConnection._compute_alias.im_func
+    _get_avatar_token = ButterflyConnection._get_avatar_token.im_func
+    _get_handle_capabilities = \
+            ButterflyConnection._get_handle_capabilities.im_func
+    _get_handle_contact_capabilities = \
+            ButterflyConnection._get_handle_contact_capabilities.im_func
+    _get_contact_capabilities = \
+            ButterflyConnection._get_contact_capabilities.im_func
+    _interned_contact_caps = ButterflyCapabilities._interned_contact_caps
+    text_chat_class = ButterflyCapabilities.text_chat_class
+    file_transfer_class = ButterflyCapabilities.file_transfer_class
+    audio_chat_class = ButterflyCapabilities.audio_chat_class
+    av_chat_class = ButterflyCapabilities.av_chat_class
+
+    def __init__(self):
+        self._handles = {}
+        self._account_handles = {}
+        self._last_handle_id = 0
+        self._avatar_known = True
+        self._alias_cache = weakref.WeakKeyDictionary()
+        self._caps = {}
+        self._contact_caps = {}
+        self._attribute_getters = {
+            telepathy.CONNECTION : [
+                ('contact-id', lambda handle, contact: handle.get_name())],
+            telepathy.CONNECTION_INTERFACE_SIMPLE_PRESENCE : [
+                ('presence', lambda handle, contact:
+                    self._get_simple_presence(contact))],
+            telepathy.CONNECTION_INTERFACE_ALIASING : [
+                ('alias', self._get_handle_alias)],
+            telepathy.CONNECTION_INTERFACE_AVATARS : [
+                ('token', lambda handle, contact:
+                    self._get_avatar_token(contact))],
+            telepathy.CONNECTION_INTERFACE_CAPABILITIES : [
+                ('caps', lambda handle, contact:
+                    self._get_handle_capabilities(handle))],
+            telepathy.CONNECTION_INTERFACE_CONTACT_CAPABILITIES : [
+                ('capabilities', lambda handle, contact:
+                    self._get_handle_contact_capabilities(handle))]
+            }
+        self._self_handle = self.create_handle(telepathy.HANDLE_TYPE_CONTACT,
+                'self@example.com')
+
+    def get_handle_id(self):
+        self._last_handle_id += 1
+        return self._last_handle_id
+
+    def check_handle(self, handle_type, handle_id):
+        if (handle_type, handle_id) not in self._handles:
+            raise telepathy.InvalidHandle('handle number %d not valid' %
+                    handle_id)
+
+
+def build_single_pass(conn, handle_ids, interfaces):
+    handle_type = telepathy.HANDLE_TYPE_CONTACT
+    handles = [conn.handle(handle_type, handle_id) for handle_id in handle_ids]
+    return conn._get_contact_attributes(handles, interfaces)
+
+
+def build_per_interface(conn, handle_ids, interfaces):
+    """Resolve the handles again for each interface and merge the
+    per-interface dictionaries, as the Get* methods used to be chained"""
+    handle_type = telepathy.HANDLE_TYPE_CONTACT
+    ret = {}
+    for interface in [telepathy.CONNECTION] + list(interfaces):
+        for attribute, getter in conn._attribute_getters[interface]:
+            values = {}
+            for handle_id in handle_ids:
+                handle = conn.handle(handle_type, handle_id)
+                value = getter(handle, handle.contact)
+                if value is not None:
+                    values[handle_id] = value
+            for handle_id, value in values.iteritems():
+                ret.setdefault(handle_id, {})[interface + '/' + attribute] = \
+                        value
+    return ret
+
+
+def run(size):
+    conn = StubConnection()
+    handle_ids = []
+    for i in xrange(size):
+        contact = StubContact('contact%d@example.com' % i)
+        handle = conn.create_handle(telepathy.HANDLE_TYPE_CONTACT,
+                contact.account, contact=contact)
+        conn._contact_caps[handle] = conn._get_contact_capabilities(contact)
+        handle_ids.append(handle.get_id())
+
+    interfaces = [interface for interface in conn._attribute_getters
+            if interface != telepathy.CONNECTION]
+
+    results = []
+    for build in (build_per_interface, build_single_pass):
+        start = time.time()
+        for i in xrange(ROUNDS):
+            build(conn, handle_ids, interfaces)
+        results.append((time.time() - start) * 1e3 / ROUNDS)
+
+    print "%6d handles: per interface %9.2f ms, single pass %9.2f ms" % \
+            (size, results[0], results[1])
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000]
+    for size in sizes:
+        run(size)
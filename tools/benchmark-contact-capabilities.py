@@ -0,0 +1,134 @@
+#!/usr/bin/python
+#
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Measure the memory taken by the requestable channel classes of a
+synthetic roster, with the classes shared between contacts of the same
+client capabilities and with a new list per contact as before.
+
+Needs telepathy-python and papyon to be importable, but no connection:
+the contacts are stubs only providing client_capabilities.
+
+Usage: tools/benchmark-contact-capabilities.py [roster size]"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from butterfly.capabilities import ButterflyCapabilities
+
+ROSTER_SIZE = 5000
+
+
+class StubClientCapabilities(object):
+    def __init__(self, supports_sip_invite, has_webcam):
+        self.supports_sip_invite = supports_sip_invite
+        self.has_webcam = has_webcam
+
+
+class StubContact(object):
+    def __init__(self, client_capabilities):
+        self.client_capabilities = client_capabilities
+
+
+class StubConnection(object):
+    """The parts of ButterflyCapabilities used to compute the requestable
+    channel classes."""
+
+    _get_contact_capabilities = \
+            ButterflyCapabilities._get_contact_capabilities.im_func
+    _interned_contact_caps = {}
+    text_chat_class = ButterflyCapabilities.text_chat_class
+    file_transfer_class = ButterflyCapabilities.file_transfer_class
+    audio_chat_class = ButterflyCapabilities.audio_chat_class
+    av_chat_class = ButterflyCapabilities.av_chat_class
+
+
+def get_contact_capabilities_unshared(conn, contact):
+    """_get_contact_capabilities before the classes were shared"""
+    contact_caps = []
+    caps = contact.client_capabilities
+
+    contact_caps.append(conn.text_chat_class)
+    contact_caps.append(conn.file_transfer_class)
+    if caps.supports_sip_invite:
+        if caps.has_webcam:
+            contact_caps.append(conn.av_chat_class)
+        else:
+            contact_caps.append(conn.audio_chat_class)
+
+    return contact_caps
+
+
+def deep_size(obj, seen):
+    """Size of an object and of everything it refers to which hasn't been
+    counted yet"""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += deep_size(item, seen)
+    return size
+
+
+def measure(name, conn, contacts, get_contact_capabilities):
+    start = time.time()
+    contact_caps = {}
+    for i, contact in enumerate(contacts):
+        contact_caps[i] = get_contact_capabilities(conn, contact)
+    elapsed = time.time() - start
+
+    # The channel classes themselves are class attributes, shared anyway
+    seen = set()
+    for channel_class in (conn.text_chat_class, conn.file_transfer_class,
+            conn.audio_chat_class, conn.av_chat_class):
+        deep_size(channel_class, seen)
+    size = deep_size(contact_caps, seen)
+
+    distinct = len(set([id(caps) for caps in contact_caps.itervalues()]))
+    print "%-9s %6d KB, %5d distinct arrays, built in %6.2f ms" % \
+            (name, size // 1024, distinct, elapsed * 1e3)
+
+
+def run(size):
+    random.seed(0)
+    contacts = []
+    for i in xrange(size):
+        sip = random.random() < 0.5
+        webcam = random.random() < 0.3
+        contacts.append(StubContact(StubClientCapabilities(sip, webcam)))
+
+    conn = StubConnection()
+    print "%d contacts:" % size
+    measure('unshared', conn, contacts, get_contact_capabilities_unshared)
+    measure('shared', conn, contacts,
+            StubConnection._get_contact_capabilities.im_func)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(int(sys.argv[1]))
+    else:
+        run(ROSTER_SIZE)
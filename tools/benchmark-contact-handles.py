@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+# telepathy-butterfly - an MSN connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Time ButterflyConnection.ensure_contact_handle against a plain
+ensure_handle lookup by name, which is what it used to do.
+
+Needs telepathy-python and papyon to be importable, but no connection:
+the lookups run on a stand-in object borrowing the connection methods.
+
+Usage: tools/benchmark-contact-handles.py [roster size ...]"""
+
+import os
+import sys
+import time
+import weakref
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import telepathy
+import papyon
+
+from butterfly.connection import ButterflyConnection
+from butterfly.handle import network_to_extension
+
+# Number of lookups timed for each roster size
+LOOKUPS = 1000
+
+
+class StubContact(object):
+    def __init__(self, account):
+        self.account = account
+        self.network_id = papyon.NetworkID.MSN
+
+
+class StubAddressBookIndex(object):
+    def learn_contact(self, contact):
+        pass
+
+
+class StubConnection(object):
+    """The parts of ButterflyConnection used to resolve contact handles."""
+
+    create_handle = ButterflyConnection.create_handle.im_func
+    ensure_contact_handle = ButterflyConnection.ensure_contact_handle.im_func
+    normalize_handle_name = ButterflyConnection.normalize_handle_name.im_func
+    is_valid_handle_name = ButterflyConnection.is_valid_handle_name.im_func
+    _is_live_handle = ButterflyConnection._is_live_handle.im_func
+    ensure_handle = telepathy.server.Connection.ensure_handle.im_func
+
+    def __init__(self):
+        self._handles = {}
+        self._contact_handles = weakref.WeakKeyDictionary()
+        self._account_handles = {}
+        self._address_book_index = StubAddressBookIndex()
+        self._last_handle_id = 0
+
+    def get_handle_id(self):
+        self._last_handle_id += 1
+        return self._last_handle_id
+
+
+def ensure_handle_by_name(conn, contact):
+    """ensure_contact_handle before the handle indexes"""
+    extension = network_to_extension.get(contact.network_id, "")
+    handle_name = contact.account.lower() + extension
+    return conn.ensure_handle(telepathy.HANDLE_TYPE_CONTACT, handle_name,
+            contact=contact)
+
+
+def run(size):
+    conn = StubConnection()
+    contacts = [StubContact('contact%d@example.com' % i)
+            for i in xrange(size)]
+    for contact in contacts:
+        conn.ensure_contact_handle(contact)
+
+    # Spread the lookups over the whole roster
+    step = max(1, size // LOOKUPS)
+    sample = [contacts[(i * step) % size] for i in xrange(LOOKUPS)]
+
+    results = []
+    for lookup in (ensure_handle_by_name,
+            StubConnection.ensure_contact_handle.im_func):
+        start = time.time()
+        for contact in sample:
+            lookup(conn, contact)
+        results.append((time.time() - start) * 1e6 / LOOKUPS)
+
+    print "%6d contacts: by name %9.2f us/lookup, indexed %6.2f us/lookup" % \
+            (size, results[0], results[1])
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000]
+    for size in sizes:
+        run(size)